@@ -0,0 +1,83 @@
+"""
+benchmark_neighbors.py
+time the direct correlation neighbor search backends against each other
+
+Sites are placed uniformly at a fixed number density, so the number of
+contacts per site is constant and only the number of sites changes.
+
+Usage: python benchmark_neighbors.py [--sizes 100 1000 10000] [--cutoff 0.6]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import mdtraj as md
+
+from pairing.neighbors import brute_force_pairs, cell_list_pairs, kdtree_pairs
+
+
+# Largest number of sites for which the quadratic backends are timed
+BRUTE_FORCE_LIMIT = 10000
+
+
+def _time(function, *args, repeat=3, **kwargs):
+    """Best wall time of several calls to a function"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _mdtraj_pairs(trj, cutoff):
+    """The brute-force path of generate_direct_correlation"""
+    rows, cols = np.triu_indices(trj.n_atoms, k=1)
+    dist = md.compute_distances(trj, np.column_stack((rows, cols)))[0]
+    return np.column_stack((rows[dist < cutoff], cols[dist < cutoff]))
+
+
+def _com_trajectory(xyz, box_length):
+    top = md.Topology()
+    chain = top.add_chain()
+    for _ in range(len(xyz)):
+        top.add_atom('C', md.element.carbon, top.add_residue('COM', chain))
+    return md.Trajectory(xyz[np.newaxis], top,
+                         unitcell_lengths=[[box_length] * 3],
+                         unitcell_angles=[[90.0] * 3])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 300, 1000, 3000, 10000, 30000, 100000])
+    parser.add_argument('--cutoff', type=float, default=0.6)
+    parser.add_argument('--density', type=float, default=10.0,
+                        help='Sites per cubic nanometer')
+    args = parser.parse_args()
+
+    columns = ['mdtraj', 'brute', 'cell', 'kdtree']
+    print('{:>8s}'.format('n_sites') + ''.join('{:>12s}'.format(c) for c in columns))
+
+    rng = np.random.RandomState(0)
+    for n_sites in args.sizes:
+        box_length = (n_sites / args.density) ** (1 / 3)
+        box = np.full(3, box_length)
+        xyz = rng.uniform(0, box_length, size=(n_sites, 3)).astype(np.float32)
+
+        timings = []
+        if n_sites <= BRUTE_FORCE_LIMIT:
+            trj = _com_trajectory(xyz, box_length)
+            timings.append(_time(_mdtraj_pairs, trj, args.cutoff))
+            timings.append(_time(brute_force_pairs, xyz, args.cutoff, box=box))
+        else:
+            timings.extend([np.nan, np.nan])
+        timings.append(_time(cell_list_pairs, xyz, args.cutoff, box=box))
+        timings.append(_time(kdtree_pairs, xyz, args.cutoff, box=box))
+
+        print('{:>8d}'.format(n_sites) + ''.join('{:>12.4g}'.format(t) for t in timings))
+
+
+if __name__ == '__main__':
+    main()
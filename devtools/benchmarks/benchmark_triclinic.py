@@ -0,0 +1,70 @@
+"""
+benchmark_triclinic.py
+time the neighbor searches in triclinic boxes against orthorhombic boxes
+
+Both boxes have the same volume and number density, so they contain the
+same number of contacts per site and only the box shape differs.
+
+Usage: python benchmark_triclinic.py [--sizes 1000 10000] [--cutoff 0.6]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from pairing.neighbors import brute_force_pairs, cell_list_pairs, kdtree_pairs
+
+
+# Largest number of sites for which the quadratic backend is timed
+BRUTE_FORCE_LIMIT = 3000
+
+# Box vectors of unit volume in the reduced form written by MD engines
+TRICLINIC_SHAPE = np.asarray([[1.0, 0.0, 0.0], [0.35, 0.95, 0.0], [-0.3, 0.25, 0.9]])
+
+
+def _time(function, *args, repeat=3, **kwargs):
+    """Best wall time of several calls to a function"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[2])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 3000, 10000, 30000, 100000])
+    parser.add_argument('--cutoff', type=float, default=0.6)
+    parser.add_argument('--density', type=float, default=10.0,
+                        help='Sites per cubic nanometer')
+    args = parser.parse_args()
+
+    searches = [('brute', brute_force_pairs), ('cell', cell_list_pairs),
+                ('kdtree', kdtree_pairs)]
+    columns = ['{}-{}'.format(name, shape) for name, _ in searches for shape in ('ortho', 'tric')]
+    print('{:>8s}'.format('n_sites') + ''.join('{:>14s}'.format(c) for c in columns))
+
+    shape = TRICLINIC_SHAPE / np.linalg.det(TRICLINIC_SHAPE) ** (1 / 3)
+    rng = np.random.RandomState(0)
+    for n_sites in args.sizes:
+        box_length = (n_sites / args.density) ** (1 / 3)
+        orthorhombic = np.full(3, box_length)
+        triclinic = shape * box_length
+        fractional = rng.uniform(0, 1, size=(n_sites, 3))
+
+        timings = []
+        for name, search in searches:
+            if name == 'brute' and n_sites > BRUTE_FORCE_LIMIT:
+                timings.extend([np.nan, np.nan])
+                continue
+            timings.append(_time(search, fractional * box_length, args.cutoff, box=orthorhombic))
+            timings.append(_time(search, fractional.dot(triclinic), args.cutoff, box=triclinic))
+
+        print('{:>8d}'.format(n_sites) + ''.join('{:>14.4g}'.format(t) for t in timings))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,10 @@ from __future__ import absolute_import
 
 # Add imports here
 from .pairing import *
+from .neighbors import *
+from .clusters import *
+from .trajectory import *
+from .dynamics import *
 
 # Handle versioneer
 from ._version import get_versions
@@ -0,0 +1,236 @@
+"""
+_numba.py
+optional Numba-compiled kernels for the pairing hot loops
+
+Each kernel repeats the arithmetic of its NumPy counterpart operation for
+operation, so both produce identical results. Numba is not a requirement:
+if it cannot be imported HAVE_NUMBA is False and callers fall back to NumPy.
+"""
+
+import warnings
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Leave functions uncompiled when Numba is missing"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+def use_numba(jit):
+    """
+    Decide whether a compiled kernel can be used
+
+    Parameters
+    ----------
+    jit : bool
+        Whether the caller asked for a compiled kernel
+
+    Returns
+    -------
+    use : bool
+        True if a kernel was requested and Numba is available
+    """
+
+    if jit and not HAVE_NUMBA:
+        warnings.warn('numba is not installed, falling back to NumPy', RuntimeWarning)
+        return False
+    return jit
+
+
+@njit(inline='always')
+def _squared_distance(xyz, i, j, box, periodic):
+    """Minimum image squared distance between two sites"""
+    dx = xyz[j, 0] - xyz[i, 0]
+    dy = xyz[j, 1] - xyz[i, 1]
+    dz = xyz[j, 2] - xyz[i, 2]
+    if periodic:
+        dx -= box[0] * np.rint(dx / box[0])
+        dy -= box[1] * np.rint(dy / box[1])
+        dz -= box[2] * np.rint(dz / box[2])
+    return dx * dx + dy * dy + dz * dz
+
+
+@njit(parallel=True)
+def brute_force_kernel(xyz, cutoff2, box, periodic):
+    """
+    Every pair of sites closer than a cutoff, checking all pairs
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3), dtype=float64
+        Site coordinates
+    cutoff2 : float
+        Squared distance cutoff
+    box : np.ndarray, shape=(3,), dtype=float64
+        Orthorhombic box lengths, ignored unless periodic
+    periodic : bool
+        Apply the minimum image convention
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Lexicographically sorted site index pairs with i < j
+    """
+
+    n_sites = xyz.shape[0]
+    counts = np.zeros(n_sites, dtype=np.int64)
+    for i in prange(n_sites):
+        count = 0
+        for j in range(i + 1, n_sites):
+            if _squared_distance(xyz, i, j, box, periodic) < cutoff2:
+                count += 1
+        counts[i] = count
+
+    offsets = np.zeros(n_sites + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    pairs = np.empty((offsets[n_sites], 2), dtype=np.int64)
+    for i in prange(n_sites):
+        k = offsets[i]
+        for j in range(i + 1, n_sites):
+            if _squared_distance(xyz, i, j, box, periodic) < cutoff2:
+                pairs[k, 0] = i
+                pairs[k, 1] = j
+                k += 1
+    return pairs
+
+
+@njit(inline='always')
+def _neighbor_cell(cell, offset, n_cells, periodic):
+    """Flat index of a neighboring cell, or -1 outside a non-periodic grid"""
+    index = 0
+    for dim in range(3):
+        c = cell[dim] + offset[dim]
+        if periodic:
+            c %= n_cells[dim]
+        elif c < 0 or c >= n_cells[dim]:
+            return -1
+        index = index * n_cells[dim] + c
+    return index
+
+
+@njit(parallel=True)
+def cell_list_kernel(xyz, cutoff2, box, periodic, cells, n_cells, order, counts, starts,
+                     half_shell):
+    """
+    Every pair of sites closer than a cutoff, checking neighboring cells
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3), dtype=float64
+        Site coordinates
+    cutoff2 : float
+        Squared distance cutoff
+    box : np.ndarray, shape=(3,), dtype=float64
+        Orthorhombic box lengths, ignored unless periodic
+    periodic : bool
+        Apply the minimum image convention and wrap the cell grid
+    cells : np.ndarray, shape=(n_sites, 3)
+        Cell of each site
+    n_cells : np.ndarray, shape=(3,)
+        Number of cells along each dimension
+    order : np.ndarray, shape=(n_sites,)
+        Sites sorted by flat cell index
+    counts, starts : np.ndarray, shape=(n_total_cells,)
+        Number of sites in each cell and their first position in order
+    half_shell : np.ndarray, shape=(14, 3)
+        Cell offsets to visit, starting with (0, 0, 0)
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Unsorted site index pairs with i < j
+    """
+
+    n_sites = xyz.shape[0]
+    n_offsets = half_shell.shape[0]
+    found = np.zeros(n_sites, dtype=np.int64)
+    for i in prange(n_sites):
+        count = 0
+        for o in range(n_offsets):
+            neighbor = _neighbor_cell(cells[i], half_shell[o], n_cells, periodic)
+            if neighbor < 0:
+                continue
+            for k in range(starts[neighbor], starts[neighbor] + counts[neighbor]):
+                j = order[k]
+                if o == 0 and j <= i:
+                    continue
+                if _squared_distance(xyz, i, j, box, periodic) < cutoff2:
+                    count += 1
+        found[i] = count
+
+    offsets = np.zeros(n_sites + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(found)
+    pairs = np.empty((offsets[n_sites], 2), dtype=np.int64)
+    for i in prange(n_sites):
+        p = offsets[i]
+        for o in range(n_offsets):
+            neighbor = _neighbor_cell(cells[i], half_shell[o], n_cells, periodic)
+            if neighbor < 0:
+                continue
+            for k in range(starts[neighbor], starts[neighbor] + counts[neighbor]):
+                j = order[k]
+                if o == 0 and j <= i:
+                    continue
+                if _squared_distance(xyz, i, j, box, periodic) < cutoff2:
+                    pairs[p, 0] = min(i, j)
+                    pairs[p, 1] = max(i, j)
+                    p += 1
+    return pairs
+
+
+@njit
+def union_find_kernel(pairs, n_sites):
+    """
+    Root of the cluster of every site after merging paired sites
+
+    Parameters
+    ----------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Pairs of site indices
+    n_sites : int
+        Number of sites
+
+    Returns
+    -------
+    roots : np.ndarray, shape=(n_sites,)
+        Root site of the cluster of each site
+    """
+
+    parent = np.arange(n_sites)
+    rank = np.zeros(n_sites, dtype=np.int64)
+
+    for k in range(pairs.shape[0]):
+        root_a = _find(parent, pairs[k, 0])
+        root_b = _find(parent, pairs[k, 1])
+        if root_a == root_b:
+            continue
+        if rank[root_a] < rank[root_b]:
+            root_a, root_b = root_b, root_a
+        parent[root_b] = root_a
+        if rank[root_a] == rank[root_b]:
+            rank[root_a] += 1
+
+    roots = np.empty(n_sites, dtype=np.int64)
+    for site in range(n_sites):
+        roots[site] = _find(parent, site)
+    return roots
+
+
+@njit(inline='always')
+def _find(parent, site):
+    """Root of a site, compressing the path on the way"""
+    root = site
+    while parent[root] != root:
+        root = parent[root]
+    while parent[site] != root:
+        parent[site], site = root, parent[site]
+    return root
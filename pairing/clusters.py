@@ -0,0 +1,639 @@
+"""
+clusters.py
+cluster sites from their direct correlation
+
+Clusters are stored as one integer label per site, numbered in order of the
+smallest site in each cluster
+"""
+
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+from . import _numba
+
+
+class DisjointSet(object):
+    """
+    Union-find forest over a fixed number of sites
+
+    Trees are merged by rank and paths are compressed on every lookup, so
+    any sequence of unions and finds runs in near-linear time.
+
+    Parameters
+    ----------
+    size : int
+        Number of sites, each initially in its own set
+    """
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+
+    def __len__(self):
+        return len(self.parent)
+
+    def find(self, site):
+        """
+        Find the root of the set containing a site
+
+        Parameters
+        ----------
+        site : int
+            Index of the site
+
+        Returns
+        -------
+        root : int
+            Index of the root site of its set
+        """
+
+        parent = self.parent
+        root = site
+        while parent[root] != root:
+            root = parent[root]
+        while parent[site] != root:
+            parent[site], site = root, parent[site]
+        return root
+
+    def union(self, a, b):
+        """
+        Merge the sets containing two sites
+
+        Parameters
+        ----------
+        a, b : int
+            Indices of the sites
+
+        Returns
+        -------
+        merged : bool
+            True if the sites were previously in different sets
+        """
+
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a == root_b:
+            return False
+
+        rank = self.rank
+        if rank[root_a] < rank[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        if rank[root_a] == rank[root_b]:
+            rank[root_a] += 1
+        return True
+
+    def union_pairs(self, pairs):
+        """
+        Merge the sets of every pair of sites
+
+        Parameters
+        ----------
+        pairs : array-like, shape=(n_pairs, 2)
+            Pairs of site indices
+        """
+
+        union = self.union
+        for a, b in np.asarray(pairs).tolist():
+            union(a, b)
+
+    def labels(self):
+        """
+        Cluster label of every site
+
+        Returns
+        -------
+        labels : np.ndarray, shape=(n_sites,)
+            Cluster index of each site
+        """
+
+        find = self.find
+        roots = np.asarray([find(site) for site in range(len(self))], dtype=int)
+        return _relabel(roots).astype(np.int32)
+
+
+class ClusterLabels(object):
+    """
+    Cluster membership of every site in one frame
+
+    Only the label of each site is stored; anything quadratic in the number
+    of sites is built on request by to_matrix.
+
+    Parameters
+    ----------
+    labels : array-like, shape=(n_sites,)
+        Cluster index of each site, numbered from zero
+    """
+
+    def __init__(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int32).reshape(-1)
+        self._order = None
+        self._starts = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return '<ClusterLabels: {} sites in {} clusters>'.format(self.n_sites, self.n_clusters)
+
+    @property
+    def n_sites(self):
+        return len(self.labels)
+
+    @property
+    def n_clusters(self):
+        return int(self.labels.max()) + 1 if self.n_sites else 0
+
+    def same_cluster(self, i, j):
+        """
+        Check whether sites are in the same cluster
+
+        Parameters
+        ----------
+        i, j : int or array-like
+            Indices of the sites to compare
+
+        Returns
+        -------
+        same : bool or np.ndarray
+            True where the sites share a cluster
+        """
+
+        return self.labels[i] == self.labels[j]
+
+    def members(self, cluster):
+        """
+        Sites in a cluster
+
+        Parameters
+        ----------
+        cluster : int
+            Index of the cluster
+
+        Returns
+        -------
+        members : np.ndarray
+            Sorted indices of the sites in the cluster
+        """
+
+        if self._order is None:
+            self._order = np.argsort(self.labels, kind='stable')
+            self._starts = np.concatenate(([0], np.cumsum(self.sizes())))
+        return self._order[self._starts[cluster]:self._starts[cluster + 1]]
+
+    def sizes(self):
+        """
+        Number of sites in every cluster
+
+        Returns
+        -------
+        sizes : np.ndarray, shape=(n_clusters,)
+            Size of each cluster
+        """
+
+        return np.bincount(self.labels, minlength=self.n_clusters)
+
+    def to_matrix(self, sparse=False):
+        """
+        Expand the labels to an indirect correlation matrix
+
+        Parameters
+        ----------
+        sparse : bool, default = False
+            Return a scipy.sparse.csr_matrix instead of a dense array
+
+        Returns
+        -------
+        indirect_corr : np.ndarray or scipy.sparse.csr_matrix
+            Matrix with ones between sites that share a cluster
+        """
+
+        if sparse:
+            return _labels_to_sparse(self.labels)
+        return (self.labels[:, np.newaxis] == self.labels[np.newaxis, :]).astype(float)
+
+
+class BitAdjacency(object):
+    """
+    Boolean adjacency matrix packed into 64-bit words
+
+    Bit j % 64 of word j // 64 in row i is set when site i is connected to
+    site j, so a matrix over N sites takes N * ceil(N / 64) * 8 bytes.
+
+    Parameters
+    ----------
+    words : np.ndarray, shape=(n_sites, n_words), dtype=uint64
+        Packed rows of the matrix
+    n_sites : int
+        Number of sites
+    """
+
+    def __init__(self, words, n_sites):
+        self.words = np.asarray(words, dtype=np.uint64)
+        self.n_sites = n_sites
+
+    def __repr__(self):
+        return '<BitAdjacency: {} sites, {} bytes>'.format(self.n_sites, self.words.nbytes)
+
+    @classmethod
+    def from_pairs(cls, pairs, n_sites):
+        """
+        Build a symmetric adjacency matrix from paired sites
+
+        Every site is connected to itself, as in a direct correlation matrix.
+
+        Parameters
+        ----------
+        pairs : array-like, shape=(n_pairs, 2)
+            Paired sites
+        n_sites : int
+            Number of sites
+
+        Returns
+        -------
+        adjacency : BitAdjacency
+            Packed adjacency matrix
+        """
+
+        pairs = np.reshape(pairs, (-1, 2)).astype(np.int64)
+        diagonal = np.arange(n_sites)
+        rows = np.concatenate((diagonal, pairs[:, 0], pairs[:, 1]))
+        cols = np.concatenate((diagonal, pairs[:, 1], pairs[:, 0]))
+
+        words = np.zeros((n_sites, _n_words(n_sites)), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (cols % 64).astype(np.uint64))
+        np.bitwise_or.at(words, (rows, cols // 64), bits)
+        return cls(words, n_sites)
+
+    @classmethod
+    def from_dense(cls, matrix):
+        """
+        Pack a dense boolean matrix
+
+        Parameters
+        ----------
+        matrix : array-like, shape=(n_sites, n_sites)
+            Matrix whose nonzero entries are connections
+
+        Returns
+        -------
+        adjacency : BitAdjacency
+            Packed adjacency matrix
+        """
+
+        matrix = np.asarray(matrix) != 0
+        n_sites = matrix.shape[0]
+        padded = np.zeros((n_sites, _n_words(n_sites) * 64), dtype=bool)
+        padded[:, :matrix.shape[1]] = matrix
+        packed = np.packbits(padded, axis=1, bitorder='little')
+        return cls(packed.view('<u8').astype(np.uint64), n_sites)
+
+    def to_dense(self):
+        """
+        Unpack to a dense boolean matrix
+
+        Returns
+        -------
+        matrix : np.ndarray, shape=(n_sites, n_sites), dtype=bool
+            Unpacked matrix
+        """
+
+        packed = self.words.astype('<u8').view(np.uint8)
+        bits = np.unpackbits(packed, axis=1, bitorder='little')
+        return bits[:, :self.n_sites].astype(bool)
+
+    def transitive_closure(self):
+        """
+        Connect every pair of sites joined by a path
+
+        Warshall's algorithm, where each step ORs row k into every row that
+        reaches site k, one 64-bit word at a time.
+
+        Returns
+        -------
+        closure : BitAdjacency
+            Packed transitive closure
+        """
+
+        words = self.words.copy()
+        for k in range(self.n_sites):
+            bit = np.uint64(k % 64)
+            reaches = ((words[:, k // 64] >> bit) & np.uint64(1)).astype(bool)
+            words[reaches] |= words[k]
+        return BitAdjacency(words, self.n_sites)
+
+    def labels(self):
+        """
+        Cluster label of every site of a symmetric transitive closure
+
+        Returns
+        -------
+        labels : np.ndarray, shape=(n_sites,)
+            Cluster index of each site
+        """
+
+        # The lowest set bit of each row is the smallest site in its cluster
+        rows = np.arange(self.n_sites)
+        first_word = (self.words != 0).argmax(axis=1)
+        word = self.words[rows, first_word]
+        lowest = word & (~word + np.uint64(1))
+        smallest = first_word * 64 + np.log2(lowest.astype(float)).astype(int)
+        return _relabel(smallest).astype(np.int32)
+
+
+class ClusterHierarchy(object):
+    """
+    Single-linkage clusters of one frame at every cutoff up to a maximum
+
+    Stores the minimum spanning forest of the contact graph, so the
+    clusters at any cutoff are the components joined by forest edges
+    shorter than that cutoff.
+
+    Parameters
+    ----------
+    edges : np.ndarray, shape=(n_edges, 2)
+        Forest edges sorted by length
+    squared_distances : np.ndarray, shape=(n_edges,)
+        Squared length of each edge
+    n_sites : int
+        Number of sites
+    max_cutoff : float
+        Largest cutoff the forest is valid for
+    """
+
+    def __init__(self, edges, squared_distances, n_sites, max_cutoff):
+        self.edges = np.asarray(edges).reshape(-1, 2)
+        self.squared_distances = np.asarray(squared_distances, dtype=float)
+        self.n_sites = n_sites
+        self.max_cutoff = max_cutoff
+
+    def __repr__(self):
+        return '<ClusterHierarchy: {} sites, {} merges below {}>'.format(
+            self.n_sites, len(self.edges), self.max_cutoff)
+
+    @classmethod
+    def from_pairs(cls, pairs, squared_distances, n_sites, max_cutoff):
+        """
+        Build the minimum spanning forest of candidate pairs with Kruskal's
+        algorithm
+
+        Parameters
+        ----------
+        pairs : array-like, shape=(n_pairs, 2)
+            Every pair of sites closer than max_cutoff
+        squared_distances : array-like, shape=(n_pairs,)
+            Squared distance of each pair
+        n_sites : int
+            Number of sites
+        max_cutoff : float
+            Cutoff used to find the pairs
+
+        Returns
+        -------
+        hierarchy : ClusterHierarchy
+            Cluster hierarchy of the pairs
+        """
+
+        pairs = np.reshape(pairs, (-1, 2))
+        squared_distances = np.asarray(squared_distances, dtype=float)
+        order = np.argsort(squared_distances, kind='stable')
+        pairs, squared_distances = pairs[order], squared_distances[order]
+
+        forest = DisjointSet(n_sites)
+        union = forest.union
+        merged = np.asarray([union(a, b) for a, b in pairs.tolist()], dtype=bool)
+        return cls(pairs[merged], squared_distances[merged], n_sites, max_cutoff)
+
+    @property
+    def distances(self):
+        """Length of each forest edge, i.e. the cutoffs at which clusters merge"""
+        return np.sqrt(self.squared_distances)
+
+    def labels(self, cutoff):
+        """
+        Clusters of sites closer than a cutoff
+
+        Parameters
+        ----------
+        cutoff : float
+            Distance cutoff below which two sites are considered paired,
+            no larger than max_cutoff
+
+        Returns
+        -------
+        clusters : ClusterLabels
+            Cluster labels of every site
+        """
+
+        if cutoff > self.max_cutoff:
+            raise ValueError('Cutoff {} is larger than the maximum cutoff {} of this '
+                             'hierarchy'.format(cutoff, self.max_cutoff))
+        stop = np.searchsorted(self.squared_distances, cutoff * cutoff, side='left')
+        return ClusterLabels(cluster_labels(self.edges[:stop], n_sites=self.n_sites,
+                                            method='csgraph'))
+
+
+def _n_words(n_sites):
+    """Number of 64-bit words needed for one bit per site"""
+    return max((n_sites + 63) // 64, 1)
+
+
+def cluster_labels(direct_corr, n_sites=None, method='union_find'):
+    """
+    Label the clusters of directly or indirectly connected sites
+
+    Parameters
+    ----------
+    direct_corr : np.ndarray, scipy.sparse matrix or array-like
+        Direct correlation matrix, or an (n_pairs, 2) array of paired sites
+    n_sites : int, optional
+        Number of sites. Required if direct_corr is an array of pairs.
+    method : str, default = 'union_find'
+        'union_find' merges paired sites with a DisjointSet, 'csgraph' runs
+        scipy.sparse.csgraph.connected_components in compiled code and
+        'numba' runs a compiled union-find, falling back to 'union_find'
+        with a warning if Numba is not installed. 'bitset' takes the
+        transitive closure of a BitAdjacency.
+
+    Returns
+    -------
+    labels : np.ndarray, shape=(n_sites,)
+        Cluster index of each site, numbered in order of the smallest site
+        in each cluster
+    """
+
+    if method == 'csgraph':
+        graph = _connected_graph(direct_corr, n_sites)
+        _, labels = connected_components(graph, directed=False)
+        return _relabel(labels).astype(np.int32)
+    if method not in ('union_find', 'numba', 'bitset'):
+        raise ValueError('Unknown clustering method {}'.format(method))
+
+    pairs, n_sites = _connected_pairs(direct_corr, n_sites)
+    if method == 'bitset':
+        return BitAdjacency.from_pairs(pairs, n_sites).transitive_closure().labels()
+    if method == 'numba' and _numba.use_numba(True):
+        roots = _numba.union_find_kernel(pairs.astype(np.int64), n_sites)
+        return _relabel(roots).astype(np.int32)
+
+    forest = DisjointSet(n_sites)
+    forest.union_pairs(pairs)
+    return forest.labels()
+
+
+def cluster_frames(frame_pairs, n_sites):
+    """
+    Label the clusters of many frames in a single pass
+
+    The pairs of every frame are offset into one block-diagonal graph, so
+    all frames are clustered by a single call to
+    scipy.sparse.csgraph.connected_components.
+
+    Parameters
+    ----------
+    frame_pairs : list of array-like
+        (n_pairs, 2) array of paired sites for each frame
+    n_sites : int
+        Number of sites in every frame
+
+    Returns
+    -------
+    labels : np.ndarray, shape=(n_frames, n_sites)
+        Cluster index of each site in each frame, numbered per frame in
+        order of the smallest site in each cluster
+    """
+
+    n_frames = len(frame_pairs)
+    counts = [len(pairs) for pairs in frame_pairs]
+    pairs = np.concatenate([np.reshape(pairs, (-1, 2)) for pairs in frame_pairs] +
+                           [np.empty((0, 2), dtype=int)])
+    pairs = pairs.astype(int) + np.repeat(np.arange(n_frames) * n_sites, counts)[:, np.newaxis]
+
+    n_nodes = n_frames * n_sites
+    data = np.ones(len(pairs), dtype=bool)
+    graph = scipy.sparse.csr_matrix((data, (pairs[:, 0], pairs[:, 1])), shape=(n_nodes, n_nodes))
+    _, labels = connected_components(graph, directed=False)
+
+    # Clusters never span frames, so once numbered by their smallest node
+    # the labels of each frame form a contiguous range
+    labels = _relabel(labels).reshape(n_frames, n_sites)
+    return (labels - labels[:, :1]).astype(np.int32)
+
+
+def _connected_graph(direct_corr, n_sites=None):
+    """
+    Sparse graph of connected sites from any direct correlation format
+
+    Parameters
+    ----------
+    direct_corr : np.ndarray, scipy.sparse matrix or array-like
+        Direct correlation matrix, or an (n_pairs, 2) array of paired sites
+    n_sites : int, optional
+        Number of sites. Required if direct_corr is an array of pairs.
+
+    Returns
+    -------
+    graph : scipy.sparse.csr_matrix, shape=(n_sites, n_sites)
+        Graph with an edge between every pair of connected sites
+    """
+
+    if scipy.sparse.issparse(direct_corr):
+        if direct_corr.shape[0] != direct_corr.shape[1]:
+            raise ValueError('Direct correlation matrix must be square')
+        # Explicitly stored zeros are not links, as for the other backends
+        return scipy.sparse.csr_matrix(direct_corr != 0)
+
+    pairs, n_sites = _connected_pairs(direct_corr, n_sites)
+    data = np.ones(len(pairs), dtype=bool)
+    return scipy.sparse.csr_matrix((data, (pairs[:, 0], pairs[:, 1])), shape=(n_sites, n_sites))
+
+
+def _connected_pairs(direct_corr, n_sites=None):
+    """
+    Distinct pairs of connected sites from any direct correlation format
+
+    Parameters
+    ----------
+    direct_corr : np.ndarray, scipy.sparse matrix or array-like
+        Direct correlation matrix, or an (n_pairs, 2) array of paired sites
+    n_sites : int, optional
+        Number of sites. Required if direct_corr is an array of pairs.
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Connected sites with i < j
+    n_sites : int
+        Number of sites
+    """
+
+    if scipy.sparse.issparse(direct_corr):
+        if direct_corr.shape[0] != direct_corr.shape[1]:
+            raise ValueError('Direct correlation matrix must be square')
+        # A link stored on either side of the diagonal connects the sites
+        connected = scipy.sparse.csr_matrix(direct_corr) != 0
+        coo = scipy.sparse.triu(connected + connected.T, k=1).tocoo()
+        return np.column_stack((coo.row, coo.col)), direct_corr.shape[0]
+
+    direct_corr = np.asarray(direct_corr)
+    if direct_corr.ndim == 2 and direct_corr.shape[0] == direct_corr.shape[1] and n_sites is None:
+        connected = direct_corr != 0
+        rows, cols = np.nonzero(np.triu(connected | connected.T, k=1))
+        return np.column_stack((rows, cols)), direct_corr.shape[0]
+
+    if n_sites is None:
+        raise ValueError('n_sites is required when clustering an array of pairs')
+    return direct_corr.reshape(-1, 2), n_sites
+
+
+def _relabel(roots):
+    """
+    Number clusters in order of the smallest site in each cluster
+
+    Parameters
+    ----------
+    roots : np.ndarray, shape=(n_sites,)
+        Any identifier of the cluster of each site
+
+    Returns
+    -------
+    labels : np.ndarray, shape=(n_sites,)
+        Cluster index of each site
+    """
+
+    _, first, inverse = np.unique(roots, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse.reshape(-1)]
+
+
+def _labels_to_sparse(labels, dtype=float):
+    """
+    Build a sparse matrix connecting every pair of sites in the same cluster
+
+    Parameters
+    ----------
+    labels : np.ndarray, shape=(n_sites,)
+        Cluster index of each site
+    dtype : data-type, default = float
+        Data type of the matrix
+
+    Returns
+    -------
+    matrix : scipy.sparse.csr_matrix, shape=(n_sites, n_sites)
+        Matrix with ones between sites that share a cluster
+    """
+
+    size = len(labels)
+    order = np.argsort(labels, kind='stable')
+    counts = np.bincount(labels, minlength=labels.max() + 1 if size else 0)
+    starts = np.cumsum(counts) - counts
+
+    n_members = counts[labels[order]]
+    rows = np.repeat(order, n_members)
+    first = np.repeat(starts[labels[order]] - np.cumsum(n_members) + n_members, n_members)
+    cols = order[first + np.arange(len(rows))]
+
+    data = np.ones(len(rows), dtype=dtype)
+    return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(size, size))
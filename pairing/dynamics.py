@@ -0,0 +1,541 @@
+"""
+dynamics.py
+time correlation functions of pairing and clustering across trajectory frames
+
+Frames are given as the per-frame paired sites returned by
+generate_direct_correlation(..., per_frame=True, output='pairs') or as the
+cluster labels of the streaming functions, and only pairs that ever form
+or clusters that overlap are tracked
+"""
+
+from collections import deque
+
+import numpy as np
+import scipy.fft
+import scipy.sparse
+
+
+def pair_presence(frame_pairs, n_sites):
+    """
+    Sparse record of the frames in which each pair of sites is paired
+
+    Parameters
+    ----------
+    frame_pairs : iterable of np.ndarray
+        (n_pairs, 2) array of paired sites (i < j) for each frame
+    n_sites : int
+        Number of sites
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_unique_pairs, 2)
+        Lexicographically sorted pairs that are paired in at least one frame
+    presence : scipy.sparse.csr_matrix, shape=(n_unique_pairs, n_frames), dtype=bool
+        Whether each pair is paired in each frame
+    """
+
+    keys, frames = [], []
+    for frame, pairs in enumerate(frame_pairs):
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        keys.append(pairs[:, 0] * n_sites + pairs[:, 1])
+        frames.append(np.full(len(pairs), frame))
+    n_frames = len(keys)
+    keys = np.concatenate(keys + [np.empty(0, dtype=np.int64)])
+    frames = np.concatenate(frames + [np.empty(0, dtype=int)])
+
+    unique_keys, rows = np.unique(keys, return_inverse=True)
+    pairs = np.column_stack((unique_keys // n_sites, unique_keys % n_sites))
+    presence = scipy.sparse.csr_matrix((np.ones(len(keys), dtype=bool), (rows.reshape(-1), frames)),
+                                       shape=(len(unique_keys), n_frames))
+    return pairs, presence
+
+
+def pair_survival(frame_pairs, n_sites, kind='intermittent', max_lag=None, chunk=4096):
+    """
+    Pair survival time correlation function, averaged over time origins
+
+    The intermittent function is the autocorrelation of the pair presence
+    h(t), <h(0) h(t)> / <h(0)>, which counts pairs that are paired again
+    after a lag whether or not they broke in between. The continuous
+    function only counts pairs that stay paired over the whole lag.
+
+    Parameters
+    ----------
+    frame_pairs : iterable of np.ndarray or scipy.sparse.spmatrix
+        (n_pairs, 2) array of paired sites (i < j) for each frame, or a
+        presence matrix returned by pair_presence
+    n_sites : int
+        Number of sites
+    kind : str, default = 'intermittent'
+        'intermittent' or 'continuous'
+    max_lag : int, optional
+        Largest lag in frames, defaults to the length of the trajectory
+        minus one
+    chunk : int, default = 4096
+        Number of pairs whose presence is made dense at a time when
+        computing the intermittent function, bounding memory to about
+        chunk times twice the number of frames
+
+    Returns
+    -------
+    correlation : np.ndarray, shape=(max_lag + 1,)
+        Correlation at every lag from 0, equal to 1 at lag 0
+    """
+
+    if kind not in ('intermittent', 'continuous'):
+        raise ValueError('Unknown correlation kind {}'.format(kind))
+    if scipy.sparse.issparse(frame_pairs):
+        presence = scipy.sparse.csr_matrix(frame_pairs, dtype=bool, copy=True)
+    else:
+        _, presence = pair_presence(frame_pairs, n_sites)
+    presence.sum_duplicates()
+    # Stored False entries would otherwise count as paired frames
+    presence.eliminate_zeros()
+    presence.sort_indices()
+
+    n_frames = presence.shape[1]
+    if max_lag is None:
+        max_lag = n_frames - 1
+    if not 0 <= max_lag < n_frames:
+        raise ValueError('max_lag must be between 0 and {}, got {}'.format(n_frames - 1, max_lag))
+    if presence.nnz == 0:
+        raise ValueError('No pairs are formed in any frame')
+
+    if kind == 'intermittent':
+        counts = _presence_autocorrelation(presence, max_lag, chunk)
+    else:
+        counts = _continuous_counts(presence, max_lag)
+
+    # Average over the n_frames - lag time origins available at each lag
+    correlation = counts / (n_frames - np.arange(max_lag + 1))
+    return correlation / correlation[0]
+
+
+def correlation_time(correlation, dt=1.0):
+    """
+    Integrate a correlation function into a correlation time
+
+    Parameters
+    ----------
+    correlation : array-like, shape=(n_lags,)
+        Correlation at evenly spaced lags starting from 0
+    dt : float, default = 1.0
+        Time between lags
+
+    Returns
+    -------
+    tau : float
+        Trapezoid rule integral of the correlation
+    """
+
+    correlation = np.asarray(correlation, dtype=float)
+    return dt * (correlation.sum() - (correlation[0] + correlation[-1]) / 2)
+
+
+class ClusterPersistence(object):
+    """
+    Cluster lifetimes and membership persistence, accumulated frame by frame
+
+    Consecutive frames are compared through the sparse contingency matrix
+    of their cluster labels, so each frame costs time linear in the number
+    of sites and only the labels of the last max_lag frames are kept.
+
+    A cluster continues into the next frame as the cluster that holds more
+    than half of its sites, provided it also supplies more than half of the
+    sites of that cluster. A cluster ends when it does not continue.
+
+    Parameters
+    ----------
+    max_lag : int, default = 0
+        Largest lag in frames of the membership correlation function
+    min_size : int, default = 2
+        Smallest cluster whose lifetime is tracked
+
+    Attributes
+    ----------
+    lifetimes : list of np.ndarray
+        Lifetimes in frames of the clusters that have ended, in order of
+        the frame in which they ended. Clusters alive in the first frame
+        may have formed before it.
+    ages : np.ndarray, shape=(n_clusters,)
+        Age in frames of each cluster of the last frame, zero for clusters
+        smaller than min_size
+    n_frames : int
+        Number of frames seen
+    """
+
+    def __init__(self, max_lag=0, min_size=2):
+        self.max_lag = max_lag
+        self.min_size = min_size
+        self.lifetimes = []
+        self.ages = None
+        self.n_frames = 0
+        # The previous frame is always needed to follow clusters
+        self._history = deque(maxlen=max(max_lag, 1))
+        self._shared = np.zeros(max_lag + 1)
+        self._origin = np.zeros(max_lag + 1)
+        self._stayed = 0
+        self._tracked = 0
+
+    def update(self, labels):
+        """
+        Add the next frame
+
+        Parameters
+        ----------
+        labels : ClusterLabels or array-like, shape=(n_sites,)
+            Cluster index of each site, numbered from zero
+        """
+
+        labels = np.asarray(getattr(labels, 'labels', labels), dtype=np.int64).reshape(-1)
+        sizes = np.bincount(labels)
+        pairs_within = _pairs_within(sizes)
+
+        # Pairs of sites sharing a cluster at both ends of every lag
+        for lag, (past, past_pairs) in enumerate(reversed(self._history), start=1):
+            if lag > self.max_lag:
+                break
+            self._shared[lag] += _pairs_within(label_contingency(past, labels).data)
+            self._origin[lag] += past_pairs
+        self._shared[0] += pairs_within
+        self._origin[0] += pairs_within
+
+        tracked = sizes >= self.min_size
+        ages = tracked.astype(int)
+        if self._history:
+            previous = self._history[-1][0]
+            previous_sizes = np.bincount(previous)
+            contingency = label_contingency(previous, labels).tocoo()
+            shared = contingency.data
+            continued = ((2 * shared > previous_sizes[contingency.row]) &
+                         (2 * shared > sizes[contingency.col]) &
+                         tracked[contingency.col] & (self.ages[contingency.row] > 0))
+            old, new = contingency.row[continued], contingency.col[continued]
+            ages[new] = self.ages[old] + 1
+
+            ended = self.ages > 0
+            ended[old] = False
+            self.lifetimes.append(self.ages[ended])
+            self._stayed += shared[continued].sum()
+            self._tracked += previous_sizes[self.ages > 0].sum()
+
+        self.ages = ages
+        self._history.append((labels, pairs_within))
+        self.n_frames += 1
+
+    @property
+    def membership_correlation(self):
+        """
+        Fraction of pairs of sites sharing a cluster that still share one
+        after each lag, averaged over time origins
+
+        Returns
+        -------
+        correlation : np.ndarray, shape=(max_lag + 1,)
+            Correlation at every lag from 0, NaN at lags longer than the
+            frames seen or if no sites ever shared a cluster
+        """
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self._origin > 0, self._shared / self._origin, np.nan)
+
+    @property
+    def persistence(self):
+        """
+        Fraction of the sites of tracked clusters that stayed in the
+        continuation of their cluster in the next frame
+
+        Returns
+        -------
+        persistence : float
+            NaN until two frames have been seen
+        """
+
+        return self._stayed / self._tracked if self._tracked else np.nan
+
+    def completed_lifetimes(self):
+        """
+        Lifetimes of every cluster that has ended
+
+        Returns
+        -------
+        lifetimes : np.ndarray
+            Lifetime in frames of each ended cluster
+        """
+
+        return np.concatenate(self.lifetimes + [np.empty(0, dtype=int)])
+
+
+def cluster_persistence(frame_labels, max_lag=0, min_size=2):
+    """
+    Cluster lifetimes and membership persistence of a sequence of frames
+
+    Parameters
+    ----------
+    frame_labels : iterable
+        ClusterLabels or label array of each frame, e.g. the cluster
+        labels yielded by stream_direct_correlation
+    max_lag : int, default = 0
+        Largest lag in frames of the membership correlation function
+    min_size : int, default = 2
+        Smallest cluster whose lifetime is tracked
+
+    Returns
+    -------
+    persistence : ClusterPersistence
+        Accumulated lifetimes, membership correlation and persistence
+    """
+
+    persistence = ClusterPersistence(max_lag=max_lag, min_size=min_size)
+    for labels in frame_labels:
+        persistence.update(labels)
+    return persistence
+
+
+# Names of the event kinds, indexed by the kind field of an event log
+EVENT_KINDS = ('birth', 'death', 'merge', 'split')
+
+EVENT_DTYPE = np.dtype([('frame', np.int64), ('kind', np.int8), ('source', np.int32),
+                        ('target', np.int32), ('sites', np.int32)])
+
+
+class ClusterEvents(object):
+    """
+    Cluster births, deaths, merges and splits, detected frame by frame
+
+    Each frame is compared with the previous one through the sparse
+    overlap (contingency) matrix of their cluster labels, restricted to
+    clusters of at least min_size sites, so each frame costs time linear
+    in the number of sites. Between two frames:
+
+    * a cluster is born if it overlaps no cluster of the previous frame
+    * a cluster dies if it overlaps no cluster of the next frame
+    * clusters merge into a cluster that overlaps two or more of them
+    * a cluster splits if it overlaps two or more clusters of the next frame
+
+    Events are recorded in a structured array of dtype EVENT_DTYPE with one
+    record per birth or death and one per overlapping pair of clusters
+    taking part in a merge or split. source and target are the cluster
+    labels in the previous and current frame, -1 for the missing side of a
+    birth or death, and sites is the number of sites they share, or the
+    size of the cluster that was born or died. kind indexes EVENT_KINDS.
+
+    Parameters
+    ----------
+    min_size : int, default = 2
+        Smallest cluster that is followed, so sites joining or leaving as
+        smaller clusters (by default single sites) do not cause events
+    min_overlap : int, default = 1
+        Smallest number of shared sites for two clusters to overlap
+
+    Attributes
+    ----------
+    n_frames : int
+        Number of frames seen
+    """
+
+    def __init__(self, min_size=2, min_overlap=1):
+        self.min_size = min_size
+        self.min_overlap = min_overlap
+        self.n_frames = 0
+        self._events = []
+        self._previous = None
+
+    def update(self, labels):
+        """
+        Add the next frame and detect the events since the previous one
+
+        Parameters
+        ----------
+        labels : ClusterLabels or array-like, shape=(n_sites,)
+            Cluster index of each site, numbered from zero
+
+        Returns
+        -------
+        events : np.ndarray, dtype=EVENT_DTYPE
+            Events between the previous frame and this one, empty for the
+            first frame
+        """
+
+        labels = np.asarray(getattr(labels, 'labels', labels), dtype=np.int64).reshape(-1)
+        previous, self._previous = self._previous, labels
+        frame = self.n_frames
+        self.n_frames += 1
+        if previous is None:
+            return np.empty(0, dtype=EVENT_DTYPE)
+
+        sizes = np.bincount(labels)
+        previous_sizes = np.bincount(previous)
+        tracked = sizes >= self.min_size
+        previous_tracked = previous_sizes >= self.min_size
+
+        overlap = label_contingency(previous, labels).tocoo()
+        kept = ((overlap.data >= self.min_overlap) & previous_tracked[overlap.row] &
+                tracked[overlap.col])
+        rows, cols, shared = overlap.row[kept], overlap.col[kept], overlap.data[kept]
+        successors = np.bincount(rows, minlength=len(previous_sizes))
+        predecessors = np.bincount(cols, minlength=len(sizes))
+
+        born = np.flatnonzero(tracked & (predecessors == 0))
+        died = np.flatnonzero(previous_tracked & (successors == 0))
+        merged = predecessors[cols] > 1
+        split = successors[rows] > 1
+
+        events = np.empty(len(born) + len(died) + merged.sum() + split.sum(), dtype=EVENT_DTYPE)
+        events['frame'] = frame
+        events['kind'] = np.repeat(np.arange(len(EVENT_KINDS), dtype=np.int8),
+                                   [len(born), len(died), merged.sum(), split.sum()])
+        events['source'] = np.concatenate((np.full(len(born), -1), died, rows[merged],
+                                           rows[split]))
+        events['target'] = np.concatenate((born, np.full(len(died), -1), cols[merged],
+                                           cols[split]))
+        events['sites'] = np.concatenate((sizes[born], previous_sizes[died], shared[merged],
+                                          shared[split]))
+        self._events.append(events)
+        return events
+
+    @property
+    def log(self):
+        """
+        Every event detected so far, in frame order
+
+        Returns
+        -------
+        events : np.ndarray, dtype=EVENT_DTYPE
+            Event log
+        """
+
+        return np.concatenate(self._events + [np.empty(0, dtype=EVENT_DTYPE)])
+
+
+def cluster_events(frame_labels, min_size=2, min_overlap=1):
+    """
+    Cluster births, deaths, merges and splits of a sequence of frames
+
+    Parameters
+    ----------
+    frame_labels : iterable
+        ClusterLabels or label array of each frame, e.g. the cluster
+        labels yielded by stream_direct_correlation
+    min_size : int, default = 2
+        Smallest cluster that is followed
+    min_overlap : int, default = 1
+        Smallest number of shared sites for two clusters to overlap
+
+    Returns
+    -------
+    events : np.ndarray, dtype=EVENT_DTYPE
+        Event log, see ClusterEvents
+    """
+
+    events = ClusterEvents(min_size=min_size, min_overlap=min_overlap)
+    for labels in frame_labels:
+        events.update(labels)
+    return events.log
+
+
+def label_contingency(first, second):
+    """
+    Number of sites shared by every pair of clusters of two frames
+
+    Parameters
+    ----------
+    first, second : array-like, shape=(n_sites,)
+        Cluster index of each site in each frame, numbered from zero
+
+    Returns
+    -------
+    contingency : scipy.sparse.csr_matrix, shape=(n_clusters_first, n_clusters_second)
+        Sites in each cluster of the first frame and each cluster of the
+        second, with only overlapping clusters stored
+    """
+
+    first = np.asarray(getattr(first, 'labels', first)).reshape(-1)
+    second = np.asarray(getattr(second, 'labels', second)).reshape(-1)
+    if len(first) != len(second):
+        raise ValueError('Frames have different numbers of sites, {} and {}'.format(
+            len(first), len(second)))
+    shape = (int(first.max(initial=-1)) + 1, int(second.max(initial=-1)) + 1)
+    contingency = scipy.sparse.csr_matrix((np.ones(len(first), dtype=np.int64),
+                                           (first, second)), shape=shape)
+    contingency.sum_duplicates()
+    return contingency
+
+
+def _pairs_within(sizes):
+    """Number of pairs of sites within groups of the given sizes"""
+    sizes = np.asarray(sizes, dtype=np.int64)
+    return (sizes * (sizes - 1) // 2).sum()
+
+
+def _presence_autocorrelation(presence, max_lag, chunk):
+    """
+    Sum over pairs and time origins of h(t) h(t + lag), through the FFT
+
+    Parameters
+    ----------
+    presence : scipy.sparse.csr_matrix, shape=(n_pairs, n_frames)
+        Whether each pair is paired in each frame
+    max_lag : int
+        Largest lag in frames
+    chunk : int
+        Number of pairs transformed at a time
+
+    Returns
+    -------
+    counts : np.ndarray, shape=(max_lag + 1,)
+        Number of (pair, origin) combinations paired at both ends of a lag
+    """
+
+    n_frames = presence.shape[1]
+    # Padding past n_frames + max_lag keeps the circular correlation from
+    # wrapping around up to the largest lag
+    n_fft = scipy.fft.next_fast_len(n_frames + max_lag + 1, real=True)
+
+    # The power spectra of the pairs add up to the spectrum of the summed
+    # autocorrelation, so only one inverse transform is needed
+    power = np.zeros(n_fft // 2 + 1)
+    for start in range(0, presence.shape[0], chunk):
+        dense = presence[start:start + chunk].toarray().astype(float)
+        spectrum = scipy.fft.rfft(dense, n=n_fft, axis=1)
+        power += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+    return np.rint(scipy.fft.irfft(power, n=n_fft)[:max_lag + 1])
+
+
+def _continuous_counts(presence, max_lag):
+    """
+    Sum over pairs and time origins of pairs paired from t to t + lag
+
+    A run of L consecutive paired frames contributes L - lag origins to
+    every lag shorter than L, so the sum follows from the histogram of run
+    lengths.
+
+    Parameters
+    ----------
+    presence : scipy.sparse.csr_matrix, shape=(n_pairs, n_frames)
+        Whether each pair is paired in each frame, with sorted indices
+    max_lag : int
+        Largest lag in frames
+
+    Returns
+    -------
+    counts : np.ndarray, shape=(max_lag + 1,)
+        Number of (pair, origin) combinations paired throughout a lag
+    """
+
+    n_frames = presence.shape[1]
+    frames = presence.indices
+    rows = np.repeat(np.arange(presence.shape[0]), np.diff(presence.indptr))
+
+    # A run starts wherever the previous entry is another pair or an
+    # earlier, non-consecutive frame
+    starts = np.ones(len(frames), dtype=bool)
+    starts[1:] = (rows[1:] != rows[:-1]) | (frames[1:] != frames[:-1] + 1)
+    lengths = np.diff(np.append(np.flatnonzero(starts), len(frames)))
+
+    histogram = np.bincount(lengths, minlength=n_frames + 1).astype(float)
+    # Runs longer than each lag, and the sum of their lengths
+    longer = np.cumsum(histogram[::-1])[::-1]
+    longer_lengths = np.cumsum((histogram * np.arange(n_frames + 1))[::-1])[::-1]
+    lags = np.arange(max_lag + 1)
+    return longer_lengths[lags + 1] - lags * longer[lags + 1]
@@ -0,0 +1,759 @@
+"""
+neighbors.py
+neighbor searches over site coordinates
+
+Every backend returns the unique pairs (i < j) of sites closer than a cutoff
+"""
+
+import itertools
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from . import _numba
+
+
+# Cell offsets visited from every cell so that each pair of neighboring
+# cells is only considered once: the cell itself plus half of its 26 neighbors
+_HALF_SHELL = np.asarray([offset for offset in itertools.product((-1, 0, 1), repeat=3)
+                          if offset > (0, 0, 0) or offset == (0, 0, 0)])
+
+# All 27 cell offsets, for searches between two different sets of sites
+_FULL_SHELL = np.asarray(list(itertools.product((-1, 0, 1), repeat=3)))
+
+# Position of each half shell offset within the full shell
+_HALF_COLUMNS = np.ravel_multi_index((_HALF_SHELL + 1).T, (3, 3, 3))
+
+
+def brute_force_pairs(xyz, cutoff, box=None, jit=False):
+    """
+    Find all pairs of sites closer than a cutoff by checking every pair
+
+    Parameters
+    ----------
+    xyz : array-like, shape=(n_sites, 3)
+        Site coordinates
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    box : array-like, shape=(3,) or (3, 3), optional
+        Orthorhombic box lengths or triclinic box vectors (one per row).
+        If None, periodic boundary conditions are not applied.
+    jit : bool, default = False
+        Use the parallel Numba kernel, falling back to NumPy with a warning
+        if Numba is not installed. Triclinic boxes always use NumPy.
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Lexicographically sorted site index pairs with i < j
+    """
+
+    xyz = np.asarray(xyz, dtype=float)
+    box = _as_box(box)
+    if _numba.use_numba(jit) and not _is_triclinic(box):
+        periodic = box is not None
+        return _numba.brute_force_kernel(xyz, cutoff * cutoff,
+                                         box if periodic else np.zeros(3), periodic)
+
+    rows, cols = np.triu_indices(len(xyz), k=1)
+    return _filter_pairs(xyz, rows, cols, cutoff, box)
+
+
+def cell_list_pairs(xyz, cutoff, box=None, jit=False, grid=None):
+    """
+    Find all pairs of sites closer than a cutoff with a linked-cell search
+
+    Sites are binned into cells with edges no shorter than the cutoff, so
+    only sites in the same or adjacent cells need to be compared. The cost
+    scales with the number of sites rather than the number of pairs. In a
+    triclinic box the cells are skewed along the box vectors and the
+    perpendicular width of each cell is no shorter than the cutoff.
+
+    Parameters
+    ----------
+    xyz : array-like, shape=(n_sites, 3)
+        Site coordinates
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    box : array-like, shape=(3,) or (3, 3), optional
+        Orthorhombic box lengths or triclinic box vectors (one per row).
+        If None, periodic boundary conditions are not applied.
+    jit : bool, default = False
+        Use the parallel Numba kernel, falling back to NumPy with a warning
+        if Numba is not installed. Triclinic boxes always use NumPy.
+    grid : CellGrid, optional
+        Cell grid kept from earlier frames, updated for this frame's box.
+        Only used with a periodic box.
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Lexicographically sorted site index pairs with i < j
+    """
+
+    xyz = np.asarray(xyz, dtype=float)
+    if len(xyz) < 2:
+        return np.empty((0, 2), dtype=int)
+    box = _as_box(box)
+
+    if box is None:
+        grid = None
+    binned = _bin_sites(xyz, cutoff, box, grid=grid)
+    if binned is None:
+        # Neighboring cells would wrap onto each other, and with this few
+        # cells there is nothing to gain over checking every pair
+        return brute_force_pairs(xyz, cutoff, box=box, jit=jit)
+    cells, n_cells, order, counts, starts = binned
+
+    if _numba.use_numba(jit) and not _is_triclinic(box):
+        periodic = box is not None
+        pairs = _numba.cell_list_kernel(xyz, cutoff * cutoff, box if periodic else np.zeros(3),
+                                        periodic, cells, n_cells, order, counts, starts,
+                                        _HALF_SHELL)
+        return _sort_pairs(pairs)
+
+    sites = np.arange(len(xyz))
+    table = None if grid is None else grid.neighbors
+    if table is not None:
+        site_cells = np.ravel_multi_index(cells.T, n_cells)
+    found = []
+    for column, offset in zip(_HALF_COLUMNS, _HALF_SHELL):
+        neighbor_index = None if table is None else table[site_cells, column]
+        rows, cols = _cell_candidates(sites, cells, offset, n_cells, order, counts, starts,
+                                      periodic=box is not None, neighbor_index=neighbor_index)
+        if not offset.any():
+            upper = rows < cols
+            rows, cols = rows[upper], cols[upper]
+        found.append(_filter_pairs(xyz, rows, cols, cutoff, box, sort=False))
+
+    return _sort_pairs(np.concatenate(found))
+
+
+def bipartite_pairs(xyz_a, xyz_b, cutoff, box=None, method='cell'):
+    """
+    Find all pairs of a site from one set and a site from another set
+    closer than a cutoff
+
+    Only the second set is binned into a cell list or KD-tree, and the
+    first set is queried against it, so pairs within a set are never
+    considered.
+
+    Parameters
+    ----------
+    xyz_a : array-like, shape=(n_sites_a, 3)
+        Coordinates of the first set of sites
+    xyz_b : array-like, shape=(n_sites_b, 3)
+        Coordinates of the second set of sites
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    box : array-like, shape=(3,) or (3, 3), optional
+        Orthorhombic box lengths or triclinic box vectors (one per row).
+        If None, periodic boundary conditions are not applied.
+    method : str, default = 'cell'
+        'cell' for a linked-cell search, 'kdtree' for a cKDTree and
+        'brute' to check every pair
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Lexicographically sorted pairs of an index into the first set and
+        an index into the second set
+    """
+
+    xyz_a = np.asarray(xyz_a, dtype=float).reshape(-1, 3)
+    xyz_b = np.asarray(xyz_b, dtype=float).reshape(-1, 3)
+    box = _as_box(box)
+    n_a = len(xyz_a)
+    xyz = np.concatenate((xyz_a, xyz_b))
+    sites_a = np.arange(n_a)
+    sites_b = np.arange(n_a, len(xyz))
+
+    grid = None
+    if method == 'cell' and len(xyz_a) and len(xyz_b):
+        grid = _bin_sites(xyz, cutoff, box, binned=sites_b)
+
+    if method == 'kdtree':
+        if box is None:
+            tree, owners = cKDTree(xyz_b), np.arange(len(xyz_b))
+            neighbors = tree.query_ball_point(xyz_a, cutoff)
+        else:
+            tree, owners = _periodic_tree(xyz_b, cutoff, box)
+            neighbors = tree.query_ball_point(_wrap(xyz_a, box), cutoff)
+        lengths = np.asarray([len(n) for n in neighbors], dtype=int)
+        rows = np.repeat(sites_a, lengths)
+        cols = owners[np.concatenate([np.asarray(n, dtype=int) for n in neighbors] +
+                                     [np.empty(0, dtype=int)])] + n_a
+        pairs = _filter_pairs(xyz, rows, cols, cutoff, box)
+        if _is_triclinic(box):
+            pairs = np.unique(pairs, axis=0)
+    elif grid is not None:
+        cells, n_cells, order, counts, starts = grid
+        found = []
+        for offset in _FULL_SHELL:
+            rows, cols = _cell_candidates(sites_a, cells[:n_a], offset, n_cells, order, counts,
+                                          starts, periodic=box is not None)
+            found.append(_filter_pairs(xyz, rows, cols, cutoff, box, sort=False))
+        pairs = _sort_pairs(np.concatenate(found))
+    elif method in ('cell', 'brute'):
+        rows = np.repeat(sites_a, len(sites_b))
+        cols = np.tile(sites_b, n_a)
+        pairs = _filter_pairs(xyz, rows, cols, cutoff, box)
+    else:
+        raise ValueError('Unknown neighbor search method {}'.format(method))
+
+    pairs[:, 1] -= n_a
+    return pairs
+
+
+class VerletList(object):
+    """
+    Neighbor list with a skin, reused across consecutive frames
+
+    Candidate pairs within cutoff + skin are found once and only these are
+    checked against the cutoff in later frames. The list is rebuilt when
+    any site has moved more than half the skin since the last build. When
+    the box changes, as in NPT trajectories, displacements are measured
+    from the reference positions scaled with the box, and the skin is
+    reduced by how much the box deformation can shorten a candidate
+    distance.
+
+    Parameters
+    ----------
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    skin : float
+        Extra distance beyond the cutoff kept in the candidate list
+    search : callable, default = cell_list_pairs
+        Neighbor search used to build the candidate list
+    """
+
+    def __init__(self, cutoff, skin, search=None):
+        self.cutoff = cutoff
+        self.skin = skin
+        self.search = cell_list_pairs if search is None else search
+        self.candidates = None
+        self.reference = None
+        self.box = None
+        self.n_builds = 0
+
+    def update(self, xyz, box=None):
+        """
+        Find the pairs of sites closer than the cutoff in a new frame
+
+        Parameters
+        ----------
+        xyz : array-like, shape=(n_sites, 3)
+            Site coordinates
+        box : array-like, shape=(3,) or (3, 3), optional
+            Orthorhombic box lengths or triclinic box vectors (one per row).
+            If None, periodic boundary conditions are not applied.
+
+        Returns
+        -------
+        pairs : np.ndarray, shape=(n_pairs, 2)
+            Lexicographically sorted site index pairs with i < j
+        """
+
+        xyz = np.asarray(xyz, dtype=float)
+        box = _as_box(box)
+        if self._needs_rebuild(xyz, box):
+            self.candidates = self.search(xyz, self.cutoff + self.skin, box=box)
+            self.reference = xyz.copy()
+            self.box = box
+            self.n_builds += 1
+
+        # Candidates are sorted, and filtering keeps their order
+        return _filter_pairs(xyz, self.candidates[:, 0], self.candidates[:, 1], self.cutoff,
+                             box, sort=False)
+
+    def _needs_rebuild(self, xyz, box):
+        """Whether the candidate list may be missing pairs of a frame"""
+        if self.candidates is None or xyz.shape != self.reference.shape:
+            return True
+        if (box is None) != (self.box is None):
+            return True
+
+        reference, stretch = self.reference, 1.0
+        if box is not None and not (box.shape == self.box.shape and
+                                    np.array_equal(box, self.box)):
+            # Map the reference positions into the new box. Distances between
+            # scaled positions are at least the smallest singular value of
+            # the deformation times the original distances.
+            deformation = np.linalg.solve(_box_matrix(self.box), _box_matrix(box))
+            reference = _cartesian(_fractional(reference, self.box), _box_matrix(box))
+            stretch = np.linalg.svd(deformation, compute_uv=False).min()
+
+        # A pair outside the list was at least cutoff + skin apart, so it
+        # cannot be closer than the cutoff until it has closed the margin
+        margin = (self.cutoff + self.skin) * stretch - self.cutoff
+        if margin <= 0:
+            return True
+        sites = np.arange(len(xyz))
+        moved = _squared_distances(np.concatenate((reference, xyz)), sites,
+                                   sites + len(xyz), box)
+        return moved.max(initial=0.0) > (margin / 2) ** 2
+
+
+class CellGrid(object):
+    """
+    Periodic cell grid kept across frames whose box fluctuates
+
+    Cells are laid out in fractional coordinates, so when the box changes
+    they scale with it and remain valid for as long as every cell stays at
+    least a cutoff wide. The grid is only rebuilt when the box changes the
+    number of cells along some dimension. A table of neighboring cells is
+    kept when there are no more cells than sites; sparser grids look up
+    neighboring cells per site instead, so memory never scales with the
+    box volume. The order of the sites by cell is also kept, so sorting
+    the sites of the next frame starts from an almost sorted order.
+
+    Attributes
+    ----------
+    n_cells : np.ndarray, shape=(3,)
+        Number of cells along each box vector
+    neighbors : np.ndarray, shape=(n_total_cells, 27), dtype=int32, or None
+        Flat index of every neighboring cell of every cell, in the order of
+        the full shell of offsets, or None if the grid has more cells than
+        sites
+    n_builds : int
+        Number of times the grid has been built
+    """
+
+    def __init__(self):
+        self.n_cells = None
+        self.neighbors = None
+        self.order = None
+        self.n_sites = None
+        self.n_builds = 0
+
+    def resize(self, cutoff, box, n_sites):
+        """
+        Fit the grid to a frame's box
+
+        Parameters
+        ----------
+        cutoff : float
+            Minimum perpendicular width of a cell
+        box : np.ndarray, shape=(3,) or (3, 3)
+            Orthorhombic box lengths or triclinic box vectors
+        n_sites : int
+            Number of sites binned into the grid
+
+        Returns
+        -------
+        n_cells : np.ndarray, shape=(3,)
+            Number of cells along each box vector
+        """
+
+        n_cells = (_box_widths(box) // cutoff).astype(int)
+        if (self.n_cells is None or not np.array_equal(n_cells, self.n_cells) or
+                n_sites != self.n_sites):
+            self.n_cells = n_cells
+            self.n_sites = n_sites
+            self.order = None
+            self.neighbors = None
+            n_total = np.prod(n_cells.astype(float))
+            if (n_cells >= 3).all() and n_total <= n_sites:
+                cells = np.indices(n_cells).reshape(3, -1).T
+                self.neighbors = np.empty((len(cells), len(_FULL_SHELL)), dtype=np.int32)
+                for column, offset in enumerate(_FULL_SHELL):
+                    self.neighbors[:, column] = np.ravel_multi_index(
+                        tuple(((cells + offset) % n_cells).T), n_cells)
+            self.n_builds += 1
+        return self.n_cells
+
+    def sort(self, cell_index):
+        """
+        Sort sites by flat cell index
+
+        Parameters
+        ----------
+        cell_index : np.ndarray, shape=(n_sites,)
+            Flat cell index of every site
+
+        Returns
+        -------
+        order : np.ndarray, shape=(n_sites,)
+            Sites sorted by cell
+        """
+
+        if self.order is None or len(self.order) != len(cell_index):
+            order = np.argsort(cell_index, kind='stable')
+        else:
+            # Sites rarely change cell between frames, and the stable sort
+            # is fastest on presorted runs
+            order = self.order[np.argsort(cell_index[self.order], kind='stable')]
+        self.order = order
+        return order
+
+
+def _bin_sites(xyz, cutoff, box, binned=None, grid=None):
+    """
+    Assign sites to a grid of cells with edges no shorter than a cutoff
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3)
+        Site coordinates
+    cutoff : float
+        Minimum cell edge
+    box : np.ndarray, shape=(3,) or (3, 3), or None
+        Orthorhombic box lengths or triclinic box vectors. If None, the
+        grid spans the sites.
+    binned : np.ndarray, optional
+        Indices of the sites to sort into cells. Defaults to every site;
+        the others are only assigned a cell.
+    grid : CellGrid, optional
+        Grid kept from earlier frames. Only used with a periodic box and
+        every site binned.
+
+    Returns
+    -------
+    grid : tuple or None
+        The cell of each site, the number of cells along each dimension,
+        the sites sorted by flat cell index and the number of sites in
+        and first sorted position of each cell. None if a periodic box is
+        too small for at least three cells along every dimension.
+    """
+
+    if box is None:
+        origin = xyz.min(axis=0)
+        lengths = np.maximum(xyz.max(axis=0) - origin, cutoff)
+        n_cells = np.maximum(np.minimum(lengths // cutoff, len(xyz)), 1).astype(np.int64)
+        # Sparse sites spread over a large volume would leave most cells
+        # empty, so coarsen the grid until there are no more cells than
+        # sites and memory scales with the sites rather than the volume
+        while np.prod(n_cells.astype(float)) > max(len(xyz), 1):
+            largest = np.argmax(n_cells)
+            n_cells[largest] = (n_cells[largest] + 1) // 2
+        cells = ((xyz - origin) / lengths * n_cells).astype(int)
+        cells = np.minimum(cells, n_cells - 1)
+    else:
+        if grid is None:
+            n_cells = (_box_widths(box) // cutoff).astype(int)
+        else:
+            n_cells = grid.resize(cutoff, box, len(xyz))
+        if (n_cells < 3).any():
+            return None
+        fractional = _fractional(xyz, box)
+        fractional -= np.floor(fractional)
+        cells = (fractional * n_cells).astype(int) % n_cells
+
+    if binned is None:
+        binned = np.arange(len(xyz))
+    cell_index = np.ravel_multi_index(cells[binned].T, n_cells)
+    if grid is not None and box is not None and len(binned) == len(xyz):
+        order = binned[grid.sort(cell_index)]
+    else:
+        order = binned[np.argsort(cell_index, kind='stable')]
+    counts = np.bincount(cell_index, minlength=np.prod(n_cells))
+    starts = np.cumsum(counts) - counts
+    return cells, n_cells, order, counts, starts
+
+
+def _cell_candidates(sites, cells, offset, n_cells, order, counts, starts, periodic,
+                     neighbor_index=None):
+    """
+    Candidate pairs between sites and the binned sites of one offset cell
+
+    Parameters
+    ----------
+    sites : np.ndarray, shape=(n_query,)
+        Indices of the sites to find candidates for
+    cells : np.ndarray, shape=(n_query, 3)
+        Cell of each of these sites
+    offset : np.ndarray, shape=(3,)
+        Offset of the neighboring cell to search
+    n_cells : np.ndarray, shape=(3,)
+        Number of cells along each dimension
+    order, counts, starts : np.ndarray
+        Binned sites sorted by flat cell index, and the number of sites in
+        and first sorted position of each cell
+    periodic : bool
+        Wrap the grid around periodic boundaries
+    neighbor_index : np.ndarray, shape=(n_query,), optional
+        Flat index of the neighboring cell of every site, looked up from a
+        CellGrid. Computed from cells and offset if not given.
+
+    Returns
+    -------
+    rows, cols : np.ndarray, shape=(n_candidates,)
+        Query site and binned site of each candidate pair
+    """
+
+    if neighbor_index is not None:
+        valid = np.ones(len(sites), dtype=bool)
+    else:
+        neighbors = cells + offset
+        if periodic:
+            neighbors %= n_cells
+            valid = np.ones(len(sites), dtype=bool)
+        else:
+            valid = ((neighbors >= 0) & (neighbors < n_cells)).all(axis=1)
+        neighbor_index = np.ravel_multi_index(neighbors[valid].T, n_cells)
+
+    n_candidates = counts[neighbor_index]
+    rows = np.repeat(sites[valid], n_candidates)
+    first = np.repeat(starts[neighbor_index] - np.cumsum(n_candidates) + n_candidates,
+                      n_candidates)
+    cols = order[first + np.arange(len(rows))]
+    return rows, cols
+
+
+def kdtree_pairs(xyz, cutoff, box=None):
+    """
+    Find all pairs of sites closer than a cutoff with a periodic KD-tree
+
+    cKDTree only supports orthorhombic periodic boxes, so in a triclinic
+    box the tree is built over the sites and their periodic images within
+    the cutoff of the box faces.
+
+    Parameters
+    ----------
+    xyz : array-like, shape=(n_sites, 3)
+        Site coordinates
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    box : array-like, shape=(3,) or (3, 3), optional
+        Orthorhombic box lengths or triclinic box vectors (one per row).
+        If None, periodic boundary conditions are not applied.
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Lexicographically sorted site index pairs with i < j
+    """
+
+    xyz = np.asarray(xyz, dtype=float)
+    box = _as_box(box)
+    if _is_triclinic(box):
+        tree, owners = _periodic_tree(xyz, cutoff, box)
+        neighbors = tree.query_ball_point(_wrap(xyz, box), cutoff)
+        lengths = np.asarray([len(n) for n in neighbors], dtype=int)
+        rows = np.repeat(np.arange(len(xyz)), lengths)
+        cols = owners[np.concatenate([np.asarray(n, dtype=int) for n in neighbors] +
+                                     [np.empty(0, dtype=int)])]
+        upper = rows < cols
+        pairs = _filter_pairs(xyz, rows[upper], cols[upper], cutoff, box, sort=False)
+        return np.unique(pairs, axis=0)
+
+    if box is None:
+        tree = cKDTree(xyz)
+    else:
+        tree = cKDTree(_wrap(xyz, box), boxsize=box)
+
+    # query_pairs also returns pairs exactly at the cutoff, so candidates are
+    # re-checked with the same criterion as the other backends
+    candidates = tree.query_pairs(cutoff, output_type='ndarray')
+    return _filter_pairs(xyz, candidates[:, 0], candidates[:, 1], cutoff, box)
+
+
+def _wrap(xyz, box):
+    """Wrap coordinates into the primary box, as cKDTree requires"""
+    if _is_triclinic(box):
+        fractional = _fractional(xyz, box)
+        return _cartesian(fractional - np.floor(fractional), box)
+    wrapped = np.mod(xyz, box)
+    wrapped[wrapped >= box] = 0.0
+    return wrapped
+
+
+def _periodic_tree(xyz, cutoff, box):
+    """
+    KD-tree over sites that finds neighbors across periodic boundaries
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3)
+        Site coordinates
+    cutoff : float
+        Largest distance that will be queried
+    box : np.ndarray, shape=(3,) or (3, 3)
+        Orthorhombic box lengths or triclinic box vectors
+
+    Returns
+    -------
+    tree : scipy.spatial.cKDTree
+        Tree to query with coordinates wrapped by _wrap
+    owners : np.ndarray, shape=(n_points,)
+        Site of every point in the tree
+    """
+
+    if not _is_triclinic(box):
+        return cKDTree(_wrap(xyz, box), boxsize=box), np.arange(len(xyz))
+
+    # Add the periodic images of sites that lie within the cutoff of the
+    # faces of the box to a non-periodic tree
+    fractional = _fractional(xyz, box)
+    fractional -= np.floor(fractional)
+    margin = cutoff / _box_widths(box)
+    sites = np.arange(len(xyz))
+    images, owners = [], []
+    for shift in _FULL_SHELL:
+        shifted = fractional + shift
+        near = ((shifted > -margin) & (shifted < 1 + margin)).all(axis=1)
+        images.append(_cartesian(shifted[near], box))
+        owners.append(sites[near])
+    return cKDTree(np.concatenate(images)), np.concatenate(owners)
+
+
+def _filter_pairs(xyz, rows, cols, cutoff, box, sort=True):
+    """
+    Keep the candidate pairs that are closer than a cutoff
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3)
+        Site coordinates
+    rows, cols : np.ndarray, shape=(n_candidates,)
+        Site indices of the candidate pairs
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    box : np.ndarray, shape=(3,) or (3, 3), or None
+        Orthorhombic box lengths or triclinic box vectors
+    sort : bool, default = True
+        Sort the pairs that are kept
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Site index pairs with i < j
+    """
+
+    d2 = _squared_distances(xyz, rows, cols, box, cutoff=cutoff)
+    paired = d2 < cutoff * cutoff
+    pairs = np.column_stack((np.minimum(rows[paired], cols[paired]),
+                             np.maximum(rows[paired], cols[paired])))
+    if sort:
+        pairs = _sort_pairs(pairs)
+    return pairs
+
+
+def _squared_distances(xyz, rows, cols, box, cutoff=None):
+    """
+    Minimum image squared distances between pairs of sites
+
+    Parameters
+    ----------
+    xyz : np.ndarray, shape=(n_sites, 3)
+        Site coordinates
+    rows, cols : np.ndarray, shape=(n_pairs,)
+        Site indices of each pair
+    box : np.ndarray, shape=(3,) or (3, 3), or None
+        Orthorhombic box lengths or triclinic box vectors
+    cutoff : float, optional
+        Only distances shorter than the cutoff are needed exactly, longer
+        ones may be overestimated in a triclinic box
+
+    Returns
+    -------
+    d2 : np.ndarray, shape=(n_pairs,)
+        Squared distance of each pair
+    """
+
+    delta = xyz[cols] - xyz[rows]
+    if _is_triclinic(box):
+        return _triclinic_squared_distances(delta, box, cutoff=cutoff)
+    if box is not None:
+        delta -= box * np.rint(delta / box)
+    return delta[:, 0] ** 2 + delta[:, 1] ** 2 + delta[:, 2] ** 2
+
+
+def _triclinic_squared_distances(delta, box, cutoff=None):
+    """
+    Minimum image squared lengths of displacements in a triclinic box
+
+    Displacements are first reduced to the nearest image in fractional
+    coordinates. Every other image is at least the smallest box width w
+    minus the reduced length away, so it can only be shorter if the reduced
+    displacement is longer than w / 2, and only shorter than a cutoff c if
+    it is longer than w - c. The 27 neighboring images are only checked for
+    those displacements. This is exact for boxes in the reduced form
+    written by MD engines.
+
+    Parameters
+    ----------
+    delta : np.ndarray, shape=(n_pairs, 3)
+        Displacements between pairs of sites
+    box : np.ndarray, shape=(3, 3)
+        Triclinic box vectors, one per row
+    cutoff : float, optional
+        Only lengths shorter than the cutoff are needed exactly
+
+    Returns
+    -------
+    d2 : np.ndarray, shape=(n_pairs,)
+        Squared minimum image length of each displacement
+    """
+
+    fractional = _fractional(delta, box)
+    fractional -= np.rint(fractional)
+    delta = _cartesian(fractional, box)
+    d2 = delta[:, 0] ** 2 + delta[:, 1] ** 2 + delta[:, 2] ** 2
+
+    width = _box_widths(box).min()
+    exact = width / 2 if cutoff is None else max(width / 2, width - cutoff)
+    far = np.flatnonzero(d2 > exact * exact)
+    if len(far):
+        delta = delta[far]
+        nearest = d2[far]
+        for shift in _cartesian(_FULL_SHELL.astype(float), box):
+            image = delta + shift
+            nearest = np.minimum(nearest, image[:, 0] ** 2 + image[:, 1] ** 2 + image[:, 2] ** 2)
+        d2[far] = nearest
+    return d2
+
+
+def _as_box(box):
+    """
+    Normalize a box to orthorhombic lengths, triclinic vectors or None
+
+    Box vectors of a rectangular box are reduced to their lengths so the
+    faster orthorhombic code paths are used.
+    """
+
+    if box is None:
+        return None
+    box = np.asarray(box, dtype=float)
+    if box.ndim == 2 and not np.count_nonzero(box - np.diag(np.diagonal(box))):
+        return np.diagonal(box).copy()
+    return box
+
+
+def _is_triclinic(box):
+    """Whether a normalized box is given by its vectors"""
+    return box is not None and box.ndim == 2
+
+
+def _box_matrix(box):
+    """Box vectors of a normalized periodic box, one per row"""
+    return box if _is_triclinic(box) else np.diag(box)
+
+
+def _box_widths(box):
+    """Distance between each pair of opposite faces of a box"""
+    if not _is_triclinic(box):
+        return box
+    normals = np.cross(box[[1, 2, 0]], box[[2, 0, 1]])
+    return abs(np.linalg.det(box)) / np.linalg.norm(normals, axis=1)
+
+
+def _fractional(xyz, box):
+    """Coordinates in units of the box vectors"""
+    if not _is_triclinic(box):
+        return xyz / box
+    return _cartesian(xyz, np.linalg.inv(box))
+
+
+def _cartesian(fractional, box):
+    """Cartesian coordinates of fractional coordinates"""
+    # Written out rather than with matmul so every row is rounded the same
+    # way however many rows there are, keeping distances bitwise repeatable
+    return (fractional[:, 0, np.newaxis] * box[0] + fractional[:, 1, np.newaxis] * box[1] +
+            fractional[:, 2, np.newaxis] * box[2])
+
+
+def _sort_pairs(pairs):
+    """Sort an array of index pairs lexicographically"""
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    return pairs[order]
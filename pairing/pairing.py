@@ -5,105 +5,624 @@ analyze pairing and clustering of molecular systems
 Handles the primary functions
 """
 
-from copy import deepcopy
-import itertools
+from functools import partial
 
 import numpy as np
+import scipy.sparse
 import mdtraj as md
 
+from .clusters import (ClusterHierarchy, ClusterLabels, DisjointSet, _labels_to_sparse,
+                       cluster_labels)
+from .neighbors import (CellGrid, VerletList, _squared_distances, bipartite_pairs, brute_force_pairs,
+                        cell_list_pairs, kdtree_pairs)
 
-def generate_direct_correlation(trj, cutoff=1.0):
+
+_NEIGHBOR_SEARCHES = {'cell': cell_list_pairs,
+                      'kdtree': kdtree_pairs,
+                      'numba': partial(cell_list_pairs, jit=True)}
+
+
+def generate_direct_correlation(trj, cutoff=1.0, method='brute', per_frame=False,
+                                output='dense', skin=None):
     """
     Genrate direct correlation matrix from a COM-based mdtraj.Trajectory.
 
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory for which "atom" sites are to be considered. Must contain
+        a single frame unless per_frame is True.
+    cutoff : float or dict, default = 1.0
+        Distance cutoff below which two sites are considered paired. A dict
+        keyed on pairs of residue names, e.g. {('CAT', 'ANI'): 0.6}, sets a
+        cutoff for each pair of species; keys are unordered and species
+        pairs without a key are never paired.
+    method : str, default = 'brute'
+        Neighbor search used to find paired sites. 'brute' evaluates every
+        pair with mdtraj, 'cell' uses a linked-cell search that scales
+        linearly with the number of sites, 'kdtree' uses a periodic
+        scipy.spatial.cKDTree and 'numba' runs the linked-cell search as a
+        parallel Numba kernel if Numba is installed.
+    per_frame : bool, default = False
+        Evaluate every frame of the trajectory at once
+    output : str, default = 'dense'
+        'dense' returns an adjacency matrix, 'sparse' returns it as a
+        scipy.sparse.csr_matrix and 'pairs' returns the paired site
+        indices (i < j).
+    skin : float, optional
+        If given, consecutive frames share a VerletList of candidate pairs
+        within cutoff + skin, built with the chosen method ('brute' builds
+        with brute_force_pairs) and rebuilt only once a site has moved more
+        than skin / 2.
+
+    Returns
+    -------
+    direct_corr : np.ndarray or list of np.ndarray
+        If output is 'dense', the direct correlation matrix, or a boolean
+        array of shape (n_frames, n_sites, n_sites) if per_frame is True.
+        If output is 'pairs', an (n_pairs, 2) array of paired sites, or a
+        list with one such array per frame if per_frame is True. If output
+        is 'sparse', the direct correlation matrix as a csr_matrix, or a
+        list with one matrix per frame if per_frame is True.
+    """
+
+    if output not in ('dense', 'sparse', 'pairs'):
+        raise ValueError('Unknown output {}'.format(output))
+    if not per_frame and trj.n_frames != 1:
+        raise ValueError('Direct correlation matrix requires a single-frame '
+                         'trajectory, got {} frames. Use per_frame=True to '
+                         'evaluate every frame.'.format(trj.n_frames))
+
+    size = trj.top.n_residues
+    neighbor_list = None if skin is None else _verlet_list(cutoff, skin, method)
+    frame_pairs = _direct_pairs(trj, cutoff, method, neighbor_list=neighbor_list)
+
+    if output == 'pairs':
+        return frame_pairs if per_frame else frame_pairs[0]
+    if output == 'sparse':
+        direct_corr = [_pairs_to_sparse(pairs, size) for pairs in frame_pairs]
+        return direct_corr if per_frame else direct_corr[0]
+
+    direct_corr = _stack_pairs(frame_pairs, size)
+    if per_frame:
+        return direct_corr
+    return direct_corr[0].astype(float)
+
+
+def _direct_pairs(trj, cutoff, method, neighbor_list=None):
+    """
+    Paired sites of every frame of a COM-based trajectory
+
     Parameters
     ----------
     trj : mdtraj.Trajectory
         Trajectory for which "atom" sites are to be considered
-    cutoff : float, default = 0.8
+    cutoff : float or dict
+        Distance cutoff below which two sites are considered paired, or
+        cutoffs keyed on pairs of residue names
+    method : str
+        Neighbor search used to find paired sites
+    neighbor_list : VerletList, optional
+        Neighbor list updated with every frame in place of a new search
+
+    Returns
+    -------
+    frame_pairs : list of np.ndarray
+        Sorted (n_pairs, 2) array of paired sites (i < j) for each frame
+    """
+
+    size = trj.top.n_residues
+    species, species_cutoffs = None, None
+    if isinstance(cutoff, dict):
+        species, species_cutoffs = _species_cutoffs(trj.top, cutoff)
+        cutoff = _max_cutoff(cutoff)
+
+    if method == 'brute' and neighbor_list is None:
+        # Only the upper triangle is evaluated, in one minimum-image aware
+        # call covering every frame
+        rows, cols = np.triu_indices(size, k=1)
+        atom_pairs = np.column_stack((rows, cols))
+        if species_cutoffs is not None:
+            cutoff = species_cutoffs[species[rows], species[cols]]
+        paired = md.compute_distances(trj, atom_pairs=atom_pairs) < cutoff
+        return [atom_pairs[frame_paired] for frame_paired in paired]
+
+    if neighbor_list is not None:
+        frame_pairs = [neighbor_list.update(trj.xyz[frame, :size], box=_frame_box(trj, frame))
+                       for frame in range(trj.n_frames)]
+    else:
+        search = _coordinate_search(method)
+        frame_pairs = [search(trj.xyz[frame, :size], cutoff, box=_frame_box(trj, frame))
+                       for frame in range(trj.n_frames)]
+
+    if species_cutoffs is not None:
+        # Pairs were found at the largest cutoff; keep those closer than the
+        # cutoff of their own species pair
+        for frame, pairs in enumerate(frame_pairs):
+            d2 = _squared_distances(trj.xyz[frame, :size].astype(float), pairs[:, 0],
+                                    pairs[:, 1], _frame_box(trj, frame))
+            pair_cutoffs = species_cutoffs[species[pairs[:, 0]], species[pairs[:, 1]]]
+            frame_pairs[frame] = pairs[d2 < pair_cutoffs * pair_cutoffs]
+    return frame_pairs
+
+
+def _species_cutoffs(topology, cutoff):
+    """
+    Cutoff matrix indexed by the species of the residues of a topology
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        Topology whose residue names define the species
+    cutoff : dict
+        Cutoffs keyed on (name, name) tuples of residue names. Keys are
+        unordered, and pairs of species without a key are never paired.
+
+    Returns
+    -------
+    species : np.ndarray, shape=(n_residues,)
+        Species index of each residue
+    species_cutoffs : np.ndarray, shape=(n_species, n_species)
+        Symmetric cutoff between every pair of species
+    """
+
+    names = np.asarray([residue.name for residue in topology.residues])
+    unique_names, species = np.unique(names, return_inverse=True)
+    index = {name: i for i, name in enumerate(unique_names)}
+
+    species_cutoffs = np.zeros((len(unique_names), len(unique_names)))
+    for (first, second), pair_cutoff in cutoff.items():
+        if first not in index or second not in index:
+            continue
+        species_cutoffs[index[first], index[second]] = pair_cutoff
+        species_cutoffs[index[second], index[first]] = pair_cutoff
+    return species.reshape(-1), species_cutoffs
+
+
+def _max_cutoff(cutoff):
+    """Largest cutoff of a scalar cutoff or of cutoffs keyed on species pairs"""
+    if isinstance(cutoff, dict):
+        return max(cutoff.values())
+    return cutoff
+
+
+def _verlet_list(cutoff, skin, method):
+    """
+    Verlet list built with one of the neighbor search methods
+
+    Parameters
+    ----------
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    skin : float
+        Extra distance beyond the cutoff kept in the candidate list
+    method : str
+        Neighbor search used to build the list
+
+    Returns
+    -------
+    neighbor_list : VerletList
+        Empty neighbor list
+    """
+
+    return VerletList(_max_cutoff(cutoff), skin, search=_coordinate_search(method))
+
+
+def _coordinate_search(method):
+    """
+    Neighbor search function working on raw coordinates
+
+    Parameters
+    ----------
+    method : str
+        Neighbor search method, where 'brute' maps to brute_force_pairs
+
+    Returns
+    -------
+    search : callable
+        Function of (xyz, cutoff, box) returning sorted paired sites. Cell
+        list searches keep their own CellGrid, so a search should be reused
+        across the frames of one trajectory.
+    """
+
+    if method == 'brute':
+        return brute_force_pairs
+    if method not in _NEIGHBOR_SEARCHES:
+        raise ValueError('Unknown neighbor search method {}'.format(method))
+    if method in ('cell', 'numba'):
+        return partial(_NEIGHBOR_SEARCHES[method], grid=CellGrid())
+    return _NEIGHBOR_SEARCHES[method]
+
+
+def _stack_pairs(frame_pairs, size):
+    """
+    Build a stack of symmetric adjacency matrices from per-frame pairs
+
+    Parameters
+    ----------
+    frame_pairs : list of np.ndarray
+        (n_pairs, 2) array of paired sites for each frame
+    size : int
+        Number of sites
+
+    Returns
+    -------
+    adjacency : np.ndarray, shape=(n_frames, size, size), dtype=bool
+        Adjacency matrix of each frame, with every site paired to itself
+    """
+
+    adjacency = np.zeros((len(frame_pairs), size, size), dtype=bool)
+    diagonal = np.arange(size)
+    adjacency[:, diagonal, diagonal] = True
+
+    frames = np.repeat(np.arange(len(frame_pairs)), [len(p) for p in frame_pairs])
+    pairs = np.concatenate(frame_pairs).reshape(-1, 2)
+    adjacency[frames, pairs[:, 0], pairs[:, 1]] = True
+    adjacency[frames, pairs[:, 1], pairs[:, 0]] = True
+    return adjacency
+
+
+def generate_residue_contacts(trj, cutoff=0.4, atom_indices=None, method='cell',
+                              per_frame=False, output='pairs'):
+    """
+    Generate direct correlation of residues from their closest atoms
+
+    Two residues are paired if any of their selected atoms are closer than
+    the cutoff. Atom pairs are found with an atom-level neighbor search and
+    reduced to unique residue pairs.
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Atomistic trajectory. Must contain a single frame unless per_frame
+        is True.
+    cutoff : float, default = 0.4
+        Distance cutoff below which two atoms are considered in contact
+    atom_indices : array-like, optional
+        Atoms considered for contacts. Defaults to every heavy atom.
+    method : str, default = 'cell'
+        Neighbor search used to find atom pairs, see
+        generate_direct_correlation
+    per_frame : bool, default = False
+        Evaluate every frame of the trajectory
+    output : str, default = 'pairs'
+        'pairs' returns the paired residue indices (i < j), 'dense' the
+        residue direct correlation matrix and 'sparse' the same as a
+        scipy.sparse.csr_matrix.
+
+    Returns
+    -------
+    direct_corr : np.ndarray or scipy.sparse.csr_matrix
+        Result of one frame, or of every frame if per_frame is True, in the
+        same form as generate_direct_correlation
+    """
+
+    if output not in ('dense', 'sparse', 'pairs'):
+        raise ValueError('Unknown output {}'.format(output))
+    if not per_frame and trj.n_frames != 1:
+        raise ValueError('Residue contacts require a single-frame trajectory, got {} frames. '
+                         'Use per_frame=True to evaluate every frame.'.format(trj.n_frames))
+
+    if atom_indices is None:
+        atom_indices = [atom.index for atom in trj.top.atoms
+                        if atom.element is not md.element.hydrogen]
+    atom_indices = np.asarray(atom_indices, dtype=int)
+    residues = np.asarray([trj.top.atom(i).residue.index for i in atom_indices], dtype=int)
+    size = trj.top.n_residues
+    search = _coordinate_search(method)
+
+    frame_pairs = []
+    for frame in range(trj.n_frames):
+        atom_pairs = search(trj.xyz[frame, atom_indices], cutoff, box=_frame_box(trj, frame))
+        first, second = residues[atom_pairs[:, 0]], residues[atom_pairs[:, 1]]
+        inter = first != second
+        first, second = first[inter], second[inter]
+        # Pack each residue pair into one integer key so np.unique sorts
+        # and deduplicates them in a single pass
+        keys = np.unique(np.minimum(first, second) * size + np.maximum(first, second))
+        frame_pairs.append(np.column_stack((keys // size, keys % size)))
+
+    if output == 'pairs':
+        return frame_pairs if per_frame else frame_pairs[0]
+    if output == 'sparse':
+        direct_corr = [_pairs_to_sparse(pairs, size) for pairs in frame_pairs]
+        return direct_corr if per_frame else direct_corr[0]
+
+    direct_corr = _stack_pairs(frame_pairs, size)
+    if per_frame:
+        return direct_corr
+    return direct_corr[0].astype(float)
+
+
+def generate_bipartite_correlation(trj, group_a, group_b, cutoff=1.0, method='cell',
+                                   per_frame=False, output='pairs'):
+    """
+    Generate the direct correlation between two groups of COM sites
+
+    Only contacts between a site of group_a and a site of group_b are
+    considered; a cell list or KD-tree is built on group_b alone and
+    queried with group_a.
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory for which "atom" sites are to be considered. Must contain
+        a single frame unless per_frame is True.
+    group_a, group_b : array-like
+        Site indices of each group
+    cutoff : float, default = 1.0
         Distance cutoff below which two sites are considered paired
+    method : str, default = 'cell'
+        'cell', 'kdtree' or 'brute', see bipartite_pairs
+    per_frame : bool, default = False
+        Evaluate every frame of the trajectory
+    output : str, default = 'pairs'
+        'pairs' returns (i, j) positions within group_a and group_b,
+        'dense' a boolean (n_a, n_b) adjacency matrix, 'sparse' the same
+        as a scipy.sparse.csr_matrix and 'clusters' the ClusterLabels of
+        every site when only A-B contacts connect sites.
+
+    Returns
+    -------
+    bipartite_corr : np.ndarray, scipy.sparse.csr_matrix or ClusterLabels
+        Result of one frame, or a list with one result per frame if
+        per_frame is True
+    """
+
+    if output not in ('pairs', 'dense', 'sparse', 'clusters'):
+        raise ValueError('Unknown output {}'.format(output))
+    if not per_frame and trj.n_frames != 1:
+        raise ValueError('Bipartite correlation requires a single-frame trajectory, got {} '
+                         'frames. Use per_frame=True to evaluate every frame.'.format(trj.n_frames))
+
+    group_a = np.asarray(group_a, dtype=int).reshape(-1)
+    group_b = np.asarray(group_b, dtype=int).reshape(-1)
+    shape = (len(group_a), len(group_b))
+
+    results = []
+    for frame in range(trj.n_frames):
+        xyz = trj.xyz[frame]
+        pairs = bipartite_pairs(xyz[group_a], xyz[group_b], cutoff,
+                                box=_frame_box(trj, frame), method=method)
+        # A site in both groups is not paired with itself
+        pairs = pairs[group_a[pairs[:, 0]] != group_b[pairs[:, 1]]]
+
+        if output == 'pairs':
+            results.append(pairs)
+        elif output == 'clusters':
+            sites = np.column_stack((group_a[pairs[:, 0]], group_b[pairs[:, 1]]))
+            results.append(ClusterLabels(cluster_labels(sites, n_sites=trj.top.n_residues,
+                                                        method='csgraph')))
+        else:
+            data = np.ones(len(pairs), dtype=bool)
+            adjacency = scipy.sparse.csr_matrix((data, (pairs[:, 0], pairs[:, 1])), shape=shape)
+            results.append(adjacency if output == 'sparse' else adjacency.toarray())
+    return results if per_frame else results[0]
+
+
+def generate_cutoff_sweep(trj, cutoffs, method='cell', output='labels'):
+    """
+    Cluster a COM-based trajectory at several cutoffs in a single pass
+
+    Candidate pairs are found once per frame at the largest cutoff and
+    sorted by distance. Clusters for increasing cutoffs are then grown by
+    merging the next slice of pairs into the same union-find forest.
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory for which "atom" sites are to be considered
+    cutoffs : array-like
+        Distance cutoffs below which two sites are considered paired
+    method : str, default = 'cell'
+        Neighbor search used to find the candidate pairs, see
+        generate_direct_correlation
+    output : str, default = 'labels'
+        'labels' returns the cluster index of every site, 'sizes' returns
+        the number of clusters of each size.
 
     Returns
     -------
-    direct_corr : np.ndarray
-        Direct correlation matrix
+    sweep : np.ndarray
+        If output is 'labels', an array of shape (n_frames, n_cutoffs,
+        n_sites) of cluster labels. If output is 'sizes', an array of shape
+        (n_frames, n_cutoffs, n_sites + 1) whose element [f, c, s] is the
+        number of clusters of s sites. Cutoffs are in the order given.
     """
 
+    if output not in ('labels', 'sizes'):
+        raise ValueError('Unknown output {}'.format(output))
+    cutoffs = np.asarray(cutoffs, dtype=float).reshape(-1)
+    search = _coordinate_search(method)
     size = trj.top.n_residues
-    direct_corr = np.zeros((size, size))
 
-    for row in range(size):
-        for col in range(size):
-            if row == col:
-                direct_corr[row, col] = 1
-            else:
-                dist = md.compute_distances(trj, atom_pairs=[(row, col)])
-                if dist < cutoff:
-                    direct_corr[row, col] = 1
-                    direct_corr[col, row] = 1
+    order = np.argsort(cutoffs)
+    labels = np.empty((trj.n_frames, len(cutoffs), size), dtype=np.int32)
+    for frame in range(trj.n_frames):
+        pairs, d2 = _candidate_pairs(trj, frame, cutoffs.max(), search)
+        by_distance = np.argsort(d2, kind='stable')
+        pairs, d2 = pairs[by_distance], d2[by_distance]
+
+        # Number of pairs closer than each cutoff, using the same criterion
+        # as the neighbor searches
+        stops = np.searchsorted(d2, cutoffs[order] * cutoffs[order], side='left')
+        forest = DisjointSet(size)
+        start = 0
+        for index, stop in zip(order, stops):
+            forest.union_pairs(pairs[start:stop])
+            labels[frame, index] = forest.labels()
+            start = stop
+
+    if output == 'labels':
+        return labels
 
-    return direct_corr
+    cluster_sizes = np.zeros(labels.shape[:2] + (size + 1,), dtype=int)
+    for frame, index in np.ndindex(*labels.shape[:2]):
+        cluster_sizes[frame, index] = np.bincount(np.bincount(labels[frame, index]),
+                                                  minlength=size + 1)
+    return cluster_sizes
 
 
-def generate_indirect_connectivity(direct_corr):
+def generate_cluster_hierarchy(trj, max_cutoff, method='cell', per_frame=False):
+    """
+    Build single-linkage cluster hierarchies of a COM-based trajectory
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory for which "atom" sites are to be considered. Must contain
+        a single frame unless per_frame is True.
+    max_cutoff : float
+        Largest cutoff at which clusters will be requested
+    method : str, default = 'cell'
+        Neighbor search used to find the candidate pairs, see
+        generate_direct_correlation
+    per_frame : bool, default = False
+        Build a hierarchy for every frame of the trajectory
+
+    Returns
+    -------
+    hierarchy : ClusterHierarchy or list of ClusterHierarchy
+        Hierarchy of the frame, or of every frame if per_frame is True
+    """
+
+    if not per_frame and trj.n_frames != 1:
+        raise ValueError('Cluster hierarchy requires a single-frame trajectory, got {} '
+                         'frames. Use per_frame=True to build every frame.'.format(trj.n_frames))
+
+    search = _coordinate_search(method)
+    hierarchies = []
+    for frame in range(trj.n_frames):
+        pairs, d2 = _candidate_pairs(trj, frame, max_cutoff, search)
+        hierarchies.append(ClusterHierarchy.from_pairs(pairs, d2, trj.top.n_residues, max_cutoff))
+    return hierarchies if per_frame else hierarchies[0]
+
+
+def _candidate_pairs(trj, frame, cutoff, search):
+    """
+    Paired sites of one frame with their squared distances
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory for which "atom" sites are to be considered
+    frame : int
+        Index of the frame
+    cutoff : float
+        Distance cutoff below which two sites are considered paired
+    search : callable
+        Neighbor search on raw coordinates
+
+    Returns
+    -------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Paired sites (i < j)
+    squared_distances : np.ndarray, shape=(n_pairs,)
+        Squared minimum image distance of each pair
+    """
+
+    size = trj.top.n_residues
+    xyz = trj.xyz[frame, :size].astype(float)
+    box = _frame_box(trj, frame)
+    pairs = search(xyz, cutoff, box=box)
+    return pairs, _squared_distances(xyz, pairs[:, 0], pairs[:, 1], box)
+
+
+def generate_indirect_connectivity(direct_corr, output='dense', method='union_find'):
     """
     Genrate indirect correlation matrix from a direct correlation matrix
 
     Parameters
     ----------
-    direct_corr : numpy.ndarray
+    direct_corr : numpy.ndarray or scipy.sparse matrix
         Direct correlation matrix from which an indirect correlation matrix
         will be generated.
+    output : str, default = 'dense'
+        'dense' returns the indirect correlation matrix, 'sparse' returns
+        it as a scipy.sparse.csr_matrix, 'labels' returns the cluster
+        index of every site and 'clusters' wraps those in a ClusterLabels.
+    method : str, default = 'union_find'
+        Clustering backend. 'union_find' merges paired sites with a
+        disjoint-set forest, 'csgraph' runs
+        scipy.sparse.csgraph.connected_components on the matrix, 'numba'
+        runs a compiled union-find if Numba is installed and 'bitset' takes
+        the transitive closure of a bit-packed adjacency matrix.
 
     Returns
     -------
-    indirect_corr : numpy.ndarray
-        Indirect corrlation matrix
+    indirect_corr : numpy.ndarray, scipy.sparse.csr_matrix or ClusterLabels
+        Indirect corrlation matrix, or the cluster labels of every site if
+        output is 'labels' or 'clusters'
     """
 
-    c = deepcopy(direct_corr)
+    if output not in ('dense', 'sparse', 'labels', 'clusters'):
+        raise ValueError('Unknown output {}'.format(output))
     size = np.shape(direct_corr)
-    if size[0] != size[1]:
+    if len(size) != 2 or size[0] != size[1]:
         raise ValueError('Direct correlation matrix must be square')
-    length = size[0]
-
-    for combo in itertools.combinations([_ for _ in range(length)], 2):
-        for i in range(length):
-            if c[i, combo[0]] == c[i, combo[1]]:
-                if c[i, combo[0]] == 0:
-                    continue
-                intersect = _find_intersection(c[:, combo[0]], c[:, combo[1]])
-                c[:, combo[0]] = intersect
-                c[:, combo[1]] = intersect
-
-    indirect_corr = c
+
+    # Clusters are found as labels over the connected pairs, so nothing
+    # quadratic in the number of sites is allocated unless a dense matrix
+    # is requested
+    labels = cluster_labels(direct_corr, method=method)
+    if output == 'labels':
+        return labels
+    if output == 'clusters':
+        return ClusterLabels(labels)
+    if output == 'sparse':
+        return _labels_to_sparse(labels, dtype=direct_corr.dtype)
+
+    indirect_corr = (labels[:, np.newaxis] == labels[np.newaxis, :]).astype(direct_corr.dtype)
     return indirect_corr
 
 
-def _find_intersection(a, b):
+def _pairs_to_sparse(pairs, size):
     """
-    Find set intersection of two arrays
+    Build a sparse direct correlation matrix from paired sites
 
     Parameters
     ----------
-    a : array-like
-        First array to compare
-    b : array-like
-        Second array to compare
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Paired sites
+    size : int
+        Number of sites
 
     Returns
     -------
-    intersection : array-like
-        Set intersection of a and b
+    direct_corr : scipy.sparse.csr_matrix, shape=(size, size)
+        Symmetric direct correlation matrix with every site paired to itself
     """
 
-    intersection = np.zeros(len(a))
-    for i in range(len(intersection)):
-        if a[i] == b[i]:
-            intersection[i] = a[i]
-        else:
-            intersection[i] = np.max([a[i], b[i]])
-    return intersection
+    diagonal = np.arange(size)
+    rows = np.concatenate((diagonal, pairs[:, 0], pairs[:, 1]))
+    cols = np.concatenate((diagonal, pairs[:, 1], pairs[:, 0]))
+    data = np.ones(len(rows))
+    return scipy.sparse.csr_matrix((data, (rows, cols)), shape=(size, size))
+
+
+def _frame_box(trj, frame):
+    """
+    Periodic box of one frame of a trajectory
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Trajectory from which the box is taken
+    frame : int
+        Index of the frame
+
+    Returns
+    -------
+    box : np.ndarray, shape=(3,) or (3, 3), or None
+        Box lengths of an orthorhombic box, box vectors of a triclinic box,
+        or None if the trajectory has no unit cell
+    """
+
+    if trj.unitcell_lengths is None:
+        return None
+    if np.allclose(trj.unitcell_angles[frame], 90.0):
+        return trj.unitcell_lengths[frame].astype(float)
+    return trj.unitcell_vectors[frame].astype(float)
 
 
 if __name__ == "__main__":
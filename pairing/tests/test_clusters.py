@@ -0,0 +1,112 @@
+"""
+Unit and regression tests for cluster labelling.
+"""
+
+import pytest
+import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+from pairing.clusters import BitAdjacency, ClusterLabels, DisjointSet, cluster_frames, cluster_labels
+
+
+def _random_pairs(n_sites, n_pairs, seed=0):
+    rng = np.random.RandomState(seed)
+    pairs = np.sort(rng.randint(0, n_sites, size=(n_pairs, 2)), axis=1)
+    return pairs[pairs[:, 0] != pairs[:, 1]]
+
+
+def test_disjoint_set():
+    forest = DisjointSet(6)
+    assert forest.union(0, 4)
+    assert forest.union(4, 2)
+    assert not forest.union(0, 2)
+    assert forest.find(2) == forest.find(0)
+    assert forest.find(1) != forest.find(0)
+    assert (forest.labels() == [0, 1, 0, 2, 0, 3]).all()
+
+
+@pytest.mark.parametrize('method', ['union_find', 'csgraph', 'bitset'])
+def test_cluster_labels_formats(method):
+    pairs = _random_pairs(300, 250)
+    dense = np.eye(300)
+    dense[pairs[:, 0], pairs[:, 1]] = 1
+    dense[pairs[:, 1], pairs[:, 0]] = 1
+
+    n_clusters, expected = connected_components(dense, directed=False)
+    labels = cluster_labels(pairs, n_sites=300, method=method)
+    assert labels.max() + 1 == n_clusters
+    assert ((labels[:, None] == labels[None, :]) == (expected[:, None] == expected[None, :])).all()
+    # Clusters are numbered in order of their smallest member
+    _, first = np.unique(labels, return_index=True)
+    assert (np.diff(first) > 0).all()
+
+    assert (labels == cluster_labels(dense, method=method)).all()
+    assert (labels == cluster_labels(scipy.sparse.csr_matrix(dense), method=method)).all()
+
+
+@pytest.mark.parametrize('method', ['union_find', 'csgraph', 'numba', 'bitset'])
+def test_cluster_labels_asymmetric(method):
+    """A link stored on only one side of the diagonal still connects sites"""
+    direct_corr = np.eye(3)
+    direct_corr[2, 0] = 1
+    assert (cluster_labels(direct_corr, method=method) == [0, 1, 0]).all()
+    sparse = scipy.sparse.csr_matrix(direct_corr)
+    assert (cluster_labels(sparse, method=method) == [0, 1, 0]).all()
+
+    # Explicitly stored zeros are not links
+    sparse = scipy.sparse.csr_matrix(([1.0, 1.0, 1.0, 0.0], ([0, 1, 2, 0], [0, 1, 2, 2])),
+                                     shape=(3, 3))
+    assert sparse.nnz == 4
+    assert (cluster_labels(sparse, method=method) == [0, 1, 2]).all()
+
+
+def test_cluster_labels_requires_size_for_pairs():
+    with pytest.raises(ValueError):
+        cluster_labels(np.asarray([[0, 1], [1, 2], [3, 4]]))
+
+
+def test_cluster_frames():
+    frame_pairs = [_random_pairs(100, n_pairs, seed=seed)
+                   for seed, n_pairs in enumerate([0, 40, 80, 120])]
+    labels = cluster_frames(frame_pairs, 100)
+    assert labels.shape == (4, 100)
+    assert (labels[0] == np.arange(100)).all()
+    for frame, pairs in enumerate(frame_pairs):
+        assert (labels[frame] == cluster_labels(pairs, n_sites=100)).all()
+
+
+def test_cluster_labels_object():
+    clusters = ClusterLabels([0, 1, 0, 2, 0, 1])
+    assert clusters.labels.dtype == np.int32
+    assert clusters.n_sites == 6
+    assert clusters.n_clusters == 3
+    assert clusters.same_cluster(0, 4)
+    assert not clusters.same_cluster(0, 1)
+    assert (clusters.same_cluster([0, 1], [2, 3]) == [True, False]).all()
+    assert (clusters.members(0) == [0, 2, 4]).all()
+    assert (clusters.members(2) == [3]).all()
+    assert (clusters.sizes() == [3, 2, 1]).all()
+
+    matrix = clusters.to_matrix()
+    assert matrix.shape == (6, 6)
+    assert (clusters.to_matrix(sparse=True).toarray() == matrix).all()
+    assert matrix[1, 5] == 1 and matrix[0, 1] == 0
+
+
+def test_bit_adjacency():
+    pairs = _random_pairs(150, 120, seed=7)
+    dense = np.eye(150, dtype=bool)
+    dense[pairs[:, 0], pairs[:, 1]] = True
+    dense[pairs[:, 1], pairs[:, 0]] = True
+
+    adjacency = BitAdjacency.from_pairs(pairs, 150)
+    assert adjacency.words.shape == (150, 3)
+    assert (adjacency.to_dense() == dense).all()
+    assert (BitAdjacency.from_dense(dense).words == adjacency.words).all()
+
+    labels = cluster_labels(pairs, n_sites=150)
+    closure = adjacency.transitive_closure()
+    assert (closure.to_dense() == (labels[:, None] == labels[None, :])).all()
+    assert (closure.labels() == labels).all()
+    assert (cluster_labels(dense, method='bitset') == labels).all()
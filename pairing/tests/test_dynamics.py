@@ -0,0 +1,152 @@
+"""
+Unit and regression tests for the pairing time correlation functions.
+"""
+
+import pytest
+import numpy as np
+import scipy.sparse
+
+import pairing
+from pairing.dynamics import (ClusterPersistence, cluster_events, cluster_persistence,
+                              label_contingency, pair_presence, pair_survival)
+from pairing.tests.utils import make_com_trajectory
+
+
+def _random_frame_pairs(n_frames, n_sites, seed):
+    """Pairs that switch on and off at random, in runs of varying length"""
+    rng = np.random.RandomState(seed)
+    rows, cols = np.triu_indices(n_sites, k=1)
+    paired = rng.uniform(size=len(rows)) < 0.1
+    frame_pairs = []
+    for _ in range(n_frames):
+        paired ^= rng.uniform(size=len(rows)) < np.where(paired, 0.2, 0.02)
+        frame_pairs.append(np.column_stack((rows[paired], cols[paired])))
+    return frame_pairs
+
+
+def _reference_survival(frame_pairs, n_sites, continuous):
+    """Survival function looping over time origins and lags"""
+    n_frames = len(frame_pairs)
+    h = np.zeros((n_frames, n_sites, n_sites), dtype=bool)
+    for frame, pairs in enumerate(frame_pairs):
+        h[frame, pairs[:, 0], pairs[:, 1]] = True
+
+    correlation = np.zeros(n_frames)
+    for lag in range(n_frames):
+        total = 0
+        for origin in range(n_frames - lag):
+            if continuous:
+                total += h[origin:origin + lag + 1].all(axis=0).sum()
+            else:
+                total += (h[origin] & h[origin + lag]).sum()
+        correlation[lag] = total / (n_frames - lag)
+    return correlation / correlation[0]
+
+
+def test_pair_presence():
+    frame_pairs = [np.asarray([[0, 1], [2, 3]]), np.empty((0, 2), dtype=int),
+                   np.asarray([[0, 1]])]
+    pairs, presence = pair_presence(frame_pairs, 4)
+    assert (pairs == [[0, 1], [2, 3]]).all()
+    assert (presence.toarray() == [[True, False, True], [True, False, False]]).all()
+
+
+@pytest.mark.parametrize('kind', ['intermittent', 'continuous'])
+def test_pair_survival(kind):
+    frame_pairs = _random_frame_pairs(40, 12, seed=0)
+    expected = _reference_survival(frame_pairs, 12, continuous=kind == 'continuous')
+
+    correlation = pair_survival(frame_pairs, 12, kind=kind, chunk=7)
+    assert np.allclose(correlation, expected)
+    assert np.allclose(pair_survival(frame_pairs, 12, kind=kind, max_lag=10), expected[:11])
+
+    # The presence matrix can be built once and reused
+    _, presence = pair_presence(frame_pairs, 12)
+    assert np.allclose(pair_survival(presence, 12, kind=kind), expected)
+
+
+@pytest.mark.parametrize('kind', ['intermittent', 'continuous'])
+def test_pair_survival_explicit_false(kind):
+    """Stored False entries of a presence matrix are not paired frames"""
+    presence = scipy.sparse.csr_matrix(([True, False, True, True], ([0, 0, 0, 0], [0, 1, 2, 3])),
+                                       shape=(1, 4))
+    assert presence.nnz == 4
+    expected = pair_survival([[[0, 1]], [], [[0, 1]], [[0, 1]]], 2, kind=kind)
+    assert np.allclose(pair_survival(presence, 2, kind=kind), expected)
+    assert presence.nnz == 4
+
+
+def test_pair_survival_from_trajectory():
+    """Continuous survival never exceeds intermittent survival"""
+    trj = make_com_trajectory(50, n_frames=10, box_length=3.0)
+    trj.xyz[1:] = trj.xyz[0] + np.cumsum(np.random.RandomState(1).normal(
+        scale=0.05, size=(9, 50, 3)), axis=0)
+    frame_pairs = pairing.generate_direct_correlation(trj, cutoff=0.8, method='cell',
+                                                      per_frame=True, output='pairs')
+    intermittent = pairing.pair_survival(frame_pairs, 50)
+    continuous = pairing.pair_survival(frame_pairs, 50, kind='continuous')
+    assert (continuous <= intermittent + 1e-12).all()
+    assert pairing.correlation_time(continuous) <= pairing.correlation_time(intermittent)
+
+
+def test_label_contingency():
+    contingency = label_contingency([0, 0, 0, 1, 1, 2], [0, 0, 1, 1, 1, 2])
+    assert (contingency.toarray() == [[2, 1, 0], [0, 2, 0], [0, 0, 1]]).all()
+    with pytest.raises(ValueError):
+        label_contingency([0, 0, 1], [0, 1])
+
+
+def test_cluster_persistence():
+    frames = [[0, 0, 0, 1, 1, 2], [0, 0, 0, 1, 2, 3], [0, 0, 1, 1, 1, 2]]
+    persistence = cluster_persistence(frames, max_lag=2)
+
+    # The pair {3, 4} breaks up after one frame, while {0, 1, 2} keeps a
+    # majority of its sites throughout and {2, 3, 4} forms in the last frame
+    assert (persistence.completed_lifetimes() == [1]).all()
+    assert (persistence.ages == [3, 1, 0]).all()
+    assert persistence.persistence == pytest.approx(5 / 8)
+    assert np.allclose(persistence.membership_correlation, [1.0, 4 / 7, 0.5])
+
+
+def test_membership_correlation():
+    """Co-membership counted through contingency matrices matches counting
+    every pair of sites"""
+    trj = make_com_trajectory(60, n_frames=8, box_length=3.0)
+    trj.xyz[1:] = trj.xyz[0] + np.cumsum(np.random.RandomState(2).normal(
+        scale=0.05, size=(7, 60, 3)), axis=0)
+    frame_pairs = pairing.generate_direct_correlation(trj, cutoff=0.6, method='cell',
+                                                      per_frame=True, output='pairs')
+    labels = [pairing.cluster_labels(pairs, n_sites=60) for pairs in frame_pairs]
+
+    persistence = ClusterPersistence(max_lag=3)
+    for frame_labels in labels:
+        persistence.update(frame_labels)
+
+    same = [frame_labels[:, np.newaxis] == frame_labels for frame_labels in labels]
+    upper = np.triu(np.ones((60, 60), dtype=bool), k=1)
+    for lag in range(4):
+        shared = sum((same[t] & same[t + lag] & upper).sum() for t in range(8 - lag))
+        origin = sum((same[t] & upper).sum() for t in range(8 - lag))
+        assert persistence.membership_correlation[lag] == pytest.approx(shared / origin)
+
+
+def test_cluster_events():
+    frames = [[0, 0, 1, 1, 2, 2, 3, 4],
+              # {0, 1} and {2, 3} merge, {6, 7} forms from single sites
+              [0, 0, 0, 0, 1, 1, 2, 2],
+              # {0, 1, 2, 3} splits, {4, 5} dissolves
+              [0, 0, 1, 1, 2, 3, 4, 4]]
+    events = cluster_events(frames)
+    kinds = [pairing.EVENT_KINDS[kind] for kind in events['kind']]
+    records = list(zip(events['frame'], kinds, events['source'], events['target'],
+                       events['sites']))
+    assert records == [(1, 'birth', -1, 2, 2),
+                       (1, 'merge', 0, 0, 2), (1, 'merge', 1, 0, 2),
+                       (2, 'death', 1, -1, 2),
+                       (2, 'split', 0, 0, 2), (2, 'split', 0, 1, 2)]
+    assert events.dtype == pairing.EVENT_DTYPE
+
+    # Exchanging a single site is ignored with a larger minimum overlap
+    swapped = [[0, 0, 0, 1, 1, 1], [0, 0, 1, 1, 1, 1]]
+    assert len(cluster_events(swapped, min_overlap=2)) == 0
+    assert len(cluster_events(swapped)) == 4
@@ -0,0 +1,184 @@
+"""
+Unit and regression tests for the neighbor search backends.
+"""
+
+import itertools
+
+import pytest
+import numpy as np
+
+from pairing.neighbors import (CellGrid, VerletList, bipartite_pairs, brute_force_pairs, cell_list_pairs,
+                               kdtree_pairs)
+
+
+@pytest.mark.parametrize('search', [cell_list_pairs, kdtree_pairs])
+@pytest.mark.parametrize('box', [None, np.asarray([4.0, 5.0, 3.5])])
+def test_neighbor_search_pairs(search, box):
+    rng = np.random.RandomState(1)
+    xyz = rng.uniform(0, 3.5, size=(500, 3))
+    cutoff = 0.6
+
+    expected = brute_force_pairs(xyz, cutoff, box=box)
+    pairs = search(xyz, cutoff, box=box)
+    assert len(expected) > 0
+    assert (pairs == expected).all()
+
+
+def test_cell_list_pairs_small_box():
+    """Boxes too small for a 3x3x3 grid still find every pair"""
+    rng = np.random.RandomState(2)
+    xyz = rng.uniform(0, 2.0, size=(50, 3))
+    box = np.asarray([2.0, 2.0, 2.0])
+    assert (cell_list_pairs(xyz, 0.9, box=box) == brute_force_pairs(xyz, 0.9, box=box)).all()
+
+
+@pytest.mark.parametrize('search', [cell_list_pairs, kdtree_pairs])
+def test_neighbor_search_outside_box(search):
+    """Coordinates outside the primary box are wrapped into it"""
+    rng = np.random.RandomState(3)
+    xyz = rng.uniform(-5.0, 10.0, size=(400, 3))
+    box = np.asarray([3.0, 3.0, 3.0])
+    expected = brute_force_pairs(xyz, 0.5, box=box)
+    assert (search(xyz, 0.5, box=box) == expected).all()
+
+
+# Box vectors in the reduced form written by MD engines
+TRICLINIC_BOX = np.asarray([[4.0, 0.0, 0.0], [1.5, 3.8, 0.0], [-1.2, 1.1, 3.6]])
+
+
+def _triclinic_reference(xyz, cutoff, box):
+    """Pairs closer than a cutoff, checking every periodic image of every pair"""
+    rows, cols = np.triu_indices(len(xyz), k=1)
+    fractional = (xyz[cols] - xyz[rows]).dot(np.linalg.inv(box))
+    fractional -= np.rint(fractional)
+    shifts = np.asarray(list(itertools.product((-1, 0, 1), repeat=3)))
+    images = (fractional[:, np.newaxis] + shifts).dot(box)
+    d2 = (images ** 2).sum(axis=2).min(axis=1)
+    return np.column_stack((rows, cols))[d2 < cutoff * cutoff]
+
+
+@pytest.mark.parametrize('search', [brute_force_pairs, cell_list_pairs, kdtree_pairs])
+def test_neighbor_search_triclinic(search):
+    rng = np.random.RandomState(12)
+    xyz = rng.uniform(-1.0, 5.0, size=(400, 3))
+    expected = _triclinic_reference(xyz, 0.8, TRICLINIC_BOX)
+    pairs = search(xyz, 0.8, box=TRICLINIC_BOX)
+    assert len(expected) > 0
+    assert (pairs == expected).all()
+
+
+@pytest.mark.parametrize('method', ['cell', 'kdtree'])
+def test_bipartite_pairs_triclinic(method):
+    rng = np.random.RandomState(13)
+    xyz = rng.uniform(0, 4.0, size=(300, 3))
+    is_a = rng.uniform(size=300) < 0.4
+    pairs = bipartite_pairs(xyz[is_a], xyz[~is_a], 0.8, box=TRICLINIC_BOX, method=method)
+    expected = bipartite_pairs(xyz[is_a], xyz[~is_a], 0.8, box=TRICLINIC_BOX, method='brute')
+    assert len(expected) > 0
+    assert (pairs == expected).all()
+
+
+def test_rectangular_box_vectors():
+    """Box vectors of a rectangular box give the same pairs as its lengths"""
+    rng = np.random.RandomState(14)
+    xyz = rng.uniform(0, 3.5, size=(300, 3))
+    box = np.asarray([4.0, 3.0, 3.5])
+    assert (cell_list_pairs(xyz, 0.6, box=np.diag(box)) == cell_list_pairs(xyz, 0.6, box=box)).all()
+
+
+def test_verlet_list():
+    rng = np.random.RandomState(8)
+    box = np.asarray([4.0, 4.0, 4.0])
+    xyz = rng.uniform(0, 4.0, size=(600, 3))
+    neighbor_list = VerletList(0.6, 0.2)
+
+    for _ in range(20):
+        xyz = xyz + rng.normal(scale=0.01, size=xyz.shape)
+        pairs = neighbor_list.update(xyz, box=box)
+        assert (pairs == cell_list_pairs(xyz, 0.6, box=box)).all()
+    assert 1 < neighbor_list.n_builds < 20
+
+    # A site moving further than half the skin forces a rebuild
+    n_builds = neighbor_list.n_builds
+    xyz[0] += 0.15
+    assert (neighbor_list.update(xyz, box=box) == cell_list_pairs(xyz, 0.6, box=box)).all()
+    assert neighbor_list.n_builds == n_builds + 1
+
+
+@pytest.mark.parametrize('method', ['cell', 'kdtree', 'brute'])
+@pytest.mark.parametrize('box', [None, np.asarray([4.0, 3.0, 3.5])])
+def test_bipartite_pairs(method, box):
+    rng = np.random.RandomState(10)
+    xyz = rng.uniform(0, 3.5, size=(500, 3))
+    is_a = rng.uniform(size=500) < 0.3
+
+    all_pairs = brute_force_pairs(xyz, 0.6, box=box)
+    expected = {tuple(p) for p in all_pairs if is_a[p[0]] != is_a[p[1]]}
+
+    pairs = bipartite_pairs(xyz[is_a], xyz[~is_a], 0.6, box=box, method=method)
+    index_a, index_b = np.flatnonzero(is_a), np.flatnonzero(~is_a)
+    found = {tuple(sorted((index_a[i], index_b[j]))) for i, j in pairs}
+    assert len(pairs) == len(expected)
+    assert found == expected
+    assert (pairs == pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]).all()
+
+
+def _npt_frames(n_frames, box, seed):
+    """Sites diffusing in a box that fluctuates by about a percent"""
+    rng = np.random.RandomState(seed)
+    fractional = rng.uniform(0, 1, size=(600, 3))
+    for _ in range(n_frames):
+        fractional = fractional + rng.normal(scale=0.002, size=fractional.shape)
+        frame_box = box * rng.uniform(0.99, 1.01)
+        if frame_box.ndim == 1:
+            yield fractional * frame_box, frame_box
+        else:
+            yield fractional.dot(frame_box), frame_box
+
+
+@pytest.mark.parametrize('box', [np.asarray([4.0, 3.9, 3.55]), TRICLINIC_BOX])
+def test_cell_grid_npt(box):
+    """The grid is only rebuilt when the box changes the number of cells"""
+    grid = CellGrid()
+    for xyz, frame_box in _npt_frames(20, box, seed=15):
+        pairs = cell_list_pairs(xyz, 0.6, box=frame_box, grid=grid)
+        assert (pairs == brute_force_pairs(xyz, 0.6, box=frame_box)).all()
+    assert 1 <= grid.n_builds < 20
+
+
+@pytest.mark.parametrize('box', [np.asarray([4.0, 4.0, 4.0]), TRICLINIC_BOX])
+def test_verlet_list_npt(box):
+    """A fluctuating box does not force a rebuild every frame"""
+    neighbor_list = VerletList(0.6, 0.3)
+    for xyz, frame_box in _npt_frames(20, box, seed=16):
+        pairs = neighbor_list.update(xyz, box=frame_box)
+        assert (pairs == cell_list_pairs(xyz, 0.6, box=frame_box)).all()
+    assert neighbor_list.n_builds < 20
+
+
+def test_cell_list_pairs_sparse_sites():
+    """Without a box the grid does not grow with the volume the sites span"""
+    xyz = np.asarray([[0.0, 0.0, 0.0], [0.3, 0.0, 0.0], [500.0, 500.0, 500.0]])
+    assert (cell_list_pairs(xyz, 0.6) == [[0, 1]]).all()
+    assert (cell_list_pairs(xyz, 0.6, jit=True) == [[0, 1]]).all()
+
+    rng = np.random.RandomState(17)
+    xyz = np.concatenate((rng.uniform(0, 3.0, size=(200, 3)),
+                          rng.uniform(0, 3.0, size=(200, 3)) + [1000.0, 0.0, 0.0]))
+    assert (cell_list_pairs(xyz, 0.6) == brute_force_pairs(xyz, 0.6)).all()
+
+
+def test_cell_grid_sparse_sites():
+    """Grids with more cells than sites skip the neighbor table"""
+    rng = np.random.RandomState(18)
+    box = np.asarray([6.0, 6.0, 6.0])
+    xyz = rng.uniform(0, 6.0, size=(300, 3))
+    grid = CellGrid()
+    assert (cell_list_pairs(xyz, 0.5, box=box, grid=grid) ==
+            brute_force_pairs(xyz, 0.5, box=box)).all()
+    assert grid.neighbors is None
+
+    grid = CellGrid()
+    cell_list_pairs(xyz, 1.5, box=box, grid=grid)
+    assert grid.neighbors.shape == (64, 27)
+    assert grid.neighbors.dtype == np.int32
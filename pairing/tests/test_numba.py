@@ -0,0 +1,47 @@
+"""
+Tests that the Numba kernels match their NumPy counterparts exactly.
+"""
+
+import pytest
+import numpy as np
+
+from pairing import _numba
+from pairing.clusters import cluster_labels
+from pairing.neighbors import brute_force_pairs, cell_list_pairs
+
+numba_only = pytest.mark.skipif(not _numba.HAVE_NUMBA, reason='numba is not installed')
+
+
+@numba_only
+@pytest.mark.parametrize('search', [brute_force_pairs, cell_list_pairs])
+@pytest.mark.parametrize('box', [None, np.asarray([4.0, 3.0, 3.5])])
+def test_neighbor_kernels(search, box):
+    rng = np.random.RandomState(4)
+    xyz = rng.uniform(-1.0, 4.0, size=(800, 3))
+    expected = search(xyz, 0.55, box=box)
+    pairs = search(xyz, 0.55, box=box, jit=True)
+    assert len(expected) > 0
+    assert pairs.shape == expected.shape
+    assert (pairs == expected).all()
+
+
+@numba_only
+def test_union_find_kernel():
+    rng = np.random.RandomState(5)
+    pairs = rng.randint(0, 500, size=(400, 2))
+    expected = cluster_labels(pairs, n_sites=500)
+    assert (cluster_labels(pairs, n_sites=500, method='numba') == expected).all()
+
+
+def test_fallback_without_numba(monkeypatch):
+    monkeypatch.setattr(_numba, 'HAVE_NUMBA', False)
+    rng = np.random.RandomState(6)
+    xyz = rng.uniform(0, 3.0, size=(200, 3))
+    box = np.asarray([3.0, 3.0, 3.0])
+    with pytest.warns(RuntimeWarning):
+        pairs = cell_list_pairs(xyz, 0.5, box=box, jit=True)
+    assert (pairs == cell_list_pairs(xyz, 0.5, box=box)).all()
+
+    with pytest.warns(RuntimeWarning):
+        labels = cluster_labels(pairs, n_sites=200, method='numba')
+    assert (labels == cluster_labels(pairs, n_sites=200)).all()
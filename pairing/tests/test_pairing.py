@@ -5,11 +5,15 @@ Unit and regression test for the pairing package.
 # Import package, test suite, and other packages as needed
 import pytest
 import numpy as np
+import scipy.sparse
+import mdtraj as md
 
 import pairing
+from pairing.tests.utils import make_com_trajectory
 
 
-def test_sevick1988():
+@pytest.mark.parametrize('method', ['union_find', 'csgraph', 'bitset'])
+def test_sevick1988(method):
     """Test the system desribed in the appendix of Sevick 1988,
     doi 10.1063/1.454720"""
     c_D = np.asarray([[1, 0, 0, 0, 1],
@@ -24,4 +28,228 @@ def test_sevick1988():
                       [0, 0, 0, 1, 0],
                       [1, 1, 1, 0, 1]])
 
-    assert (c_I == pairing.generate_indirect_connectivity(c_D)).all()
+    assert (c_I == pairing.generate_indirect_connectivity(c_D, method=method)).all()
+
+
+def test_direct_correlation_matches_pairwise():
+    """The batched distance engine reproduces per-pair mdtraj calls"""
+    trj = make_com_trajectory(40)
+    cutoff = 0.8
+
+    expected = np.eye(40)
+    for row in range(40):
+        for col in range(row + 1, 40):
+            dist = md.compute_distances(trj, atom_pairs=[(row, col)])
+            if dist < cutoff:
+                expected[row, col] = 1
+                expected[col, row] = 1
+
+    direct_corr = pairing.generate_direct_correlation(trj, cutoff=cutoff)
+    assert direct_corr.shape == (40, 40)
+    assert (direct_corr == expected).all()
+
+
+def test_direct_correlation_rejects_multiple_frames():
+    trj = make_com_trajectory(10, n_frames=2)
+    with pytest.raises(ValueError):
+        pairing.generate_direct_correlation(trj)
+
+
+@pytest.mark.parametrize('method', ['cell', 'kdtree', 'numba'])
+def test_neighbor_search_matches_brute_force(method):
+    trj = make_com_trajectory(300, box_length=4.0)
+    brute = pairing.generate_direct_correlation(trj, cutoff=0.7)
+    direct_corr = pairing.generate_direct_correlation(trj, cutoff=0.7, method=method)
+    assert (brute == direct_corr).all()
+
+
+@pytest.mark.parametrize('method', ['cell', 'kdtree', 'numba'])
+def test_neighbor_search_triclinic(method):
+    trj = make_com_trajectory(300, box_length=4.0, seed=4)
+    trj.unitcell_angles = [[80.0, 75.0, 95.0]]
+    brute = pairing.generate_direct_correlation(trj, cutoff=0.7)
+    direct_corr = pairing.generate_direct_correlation(trj, cutoff=0.7, method=method)
+    assert (brute == direct_corr).all()
+
+
+@pytest.mark.parametrize('method', ['brute', 'cell', 'kdtree'])
+def test_direct_correlation_per_frame(method):
+    trj = make_com_trajectory(60, n_frames=4)
+    stacked = pairing.generate_direct_correlation(trj, cutoff=0.8, method=method,
+                                                  per_frame=True)
+    frame_pairs = pairing.generate_direct_correlation(trj, cutoff=0.8, method=method,
+                                                      per_frame=True, output='pairs')
+    assert stacked.shape == (4, 60, 60)
+    assert stacked.dtype == bool
+    assert len(frame_pairs) == 4
+
+    for frame in range(4):
+        expected = pairing.generate_direct_correlation(trj[frame], cutoff=0.8)
+        assert (stacked[frame] == expected).all()
+        rows, cols = np.nonzero(np.triu(expected, k=1))
+        assert (frame_pairs[frame] == np.column_stack((rows, cols))).all()
+
+
+def test_sevick1988_sparse():
+    c_D = scipy.sparse.csr_matrix(np.asarray([[1, 0, 0, 0, 1],
+                                              [0, 1, 1, 0, 0],
+                                              [0, 1, 1, 0, 1],
+                                              [0, 0, 0, 1, 0],
+                                              [1, 0, 1, 0, 1]]))
+
+    c_I = np.asarray([[1, 1, 1, 0, 1],
+                      [1, 1, 1, 0, 1],
+                      [1, 1, 1, 0, 1],
+                      [0, 0, 0, 1, 0],
+                      [1, 1, 1, 0, 1]])
+
+    indirect_corr = pairing.generate_indirect_connectivity(c_D, output='sparse')
+    assert scipy.sparse.issparse(indirect_corr)
+    assert (indirect_corr.toarray() == c_I).all()
+    assert (pairing.generate_indirect_connectivity(c_D) == c_I).all()
+    labels = pairing.generate_indirect_connectivity(c_D, output='labels')
+    assert (labels == [0, 0, 0, 1, 0]).all()
+    clusters = pairing.generate_indirect_connectivity(c_D, output='clusters')
+    assert (clusters.to_matrix() == c_I).all()
+
+
+def test_sparse_direct_correlation_end_to_end():
+    trj = make_com_trajectory(200, box_length=4.0)
+    dense = pairing.generate_direct_correlation(trj, cutoff=0.6)
+    sparse = pairing.generate_direct_correlation(trj, cutoff=0.6, method='cell',
+                                                 output='sparse')
+    assert scipy.sparse.issparse(sparse)
+    assert (sparse.toarray() == dense).all()
+
+    labels = pairing.generate_indirect_connectivity(dense, output='labels')
+    assert (pairing.generate_indirect_connectivity(sparse, output='labels') == labels).all()
+    indirect = pairing.generate_indirect_connectivity(sparse, output='sparse')
+    assert (indirect.toarray() == (labels[:, None] == labels[None, :])).all()
+
+
+def test_direct_correlation_verlet_skin():
+    trj = make_com_trajectory(200, n_frames=5, box_length=4.0)
+    # Small steps from the first frame so the neighbor list is reused
+    trj.xyz[1:] = trj.xyz[0] + np.cumsum(np.random.RandomState(9).normal(
+        scale=0.005, size=(4, 200, 3)), axis=0)
+
+    expected = pairing.generate_direct_correlation(trj, cutoff=0.6, method='cell',
+                                                   per_frame=True, output='pairs')
+    frame_pairs = pairing.generate_direct_correlation(trj, cutoff=0.6, method='cell',
+                                                      per_frame=True, output='pairs', skin=0.1)
+    for pairs, frame_expected in zip(frame_pairs, expected):
+        assert (pairs == frame_expected).all()
+
+
+def test_cutoff_sweep():
+    trj = make_com_trajectory(150, n_frames=2, box_length=4.0)
+    cutoffs = [0.7, 0.3, 0.5]
+    labels = pairing.generate_cutoff_sweep(trj, cutoffs)
+    sizes = pairing.generate_cutoff_sweep(trj, cutoffs, output='sizes')
+    assert labels.shape == (2, 3, 150)
+    assert sizes.shape == (2, 3, 151)
+
+    for frame in range(2):
+        for index, cutoff in enumerate(cutoffs):
+            pairs = pairing.generate_direct_correlation(trj[frame], cutoff=cutoff,
+                                                        method='cell', output='pairs')
+            expected = pairing.cluster_labels(pairs, n_sites=150)
+            assert (labels[frame, index] == expected).all()
+            assert (sizes[frame, index] * np.arange(151)).sum() == 150
+            assert sizes[frame, index].sum() == expected.max() + 1
+
+
+def test_cluster_hierarchy():
+    trj = make_com_trajectory(150, n_frames=2, box_length=4.0)
+    hierarchies = pairing.generate_cluster_hierarchy(trj, 0.8, per_frame=True)
+    assert len(hierarchies) == 2
+
+    for frame, hierarchy in enumerate(hierarchies):
+        assert len(hierarchy.edges) < 150
+        assert (np.diff(hierarchy.distances) >= 0).all()
+        for cutoff in [0.2, 0.45, 0.8]:
+            pairs = pairing.generate_direct_correlation(trj[frame], cutoff=cutoff,
+                                                        method='cell', output='pairs')
+            expected = pairing.cluster_labels(pairs, n_sites=150)
+            assert (hierarchy.labels(cutoff).labels == expected).all()
+
+    with pytest.raises(ValueError):
+        hierarchies[0].labels(0.9)
+
+
+@pytest.mark.parametrize('method', ['brute', 'cell', 'kdtree'])
+def test_species_cutoffs(method):
+    trj = make_com_trajectory(240, box_length=4.0, names=('CAT', 'ANI', 'SOL'))
+    cutoffs = {('CAT', 'ANI'): 0.7, ('CAT', 'CAT'): 0.9, ('SOL', 'ANI'): 0.5}
+    pairs = pairing.generate_direct_correlation(trj, cutoff=cutoffs, method=method,
+                                                output='pairs')
+
+    names = np.asarray([residue.name for residue in trj.top.residues])
+    dist = md.compute_distances(trj, pairs)[0]
+    rows, cols = np.triu_indices(240, k=1)
+    all_dist = md.compute_distances(trj, np.column_stack((rows, cols)))[0]
+    expected = set()
+    for (first, second), cutoff in cutoffs.items():
+        for a, b in [(first, second), (second, first)]:
+            match = (names[rows] == a) & (names[cols] == b) & (all_dist < cutoff)
+            expected.update(zip(rows[match], cols[match]))
+
+    assert set(map(tuple, pairs)) == expected
+    assert not ((names[pairs[:, 0]] == 'SOL') & (names[pairs[:, 1]] == 'SOL')).any()
+    assert (dist < 0.9).all()
+
+
+def test_bipartite_correlation():
+    trj = make_com_trajectory(200, box_length=4.0)
+    cations, anions = np.arange(0, 200, 2), np.arange(1, 200, 2)
+    direct_corr = pairing.generate_direct_correlation(trj, cutoff=0.7, method='cell')
+
+    adjacency = pairing.generate_bipartite_correlation(trj, cations, anions, cutoff=0.7,
+                                                       output='dense')
+    assert adjacency.shape == (100, 100)
+    assert (adjacency == direct_corr[np.ix_(cations, anions)]).all()
+
+    expected = direct_corr.copy()
+    expected[np.ix_(cations, cations)] = 0
+    expected[np.ix_(anions, anions)] = 0
+    clusters = pairing.generate_bipartite_correlation(trj, cations, anions, cutoff=0.7,
+                                                      output='clusters')
+    assert (clusters.labels == pairing.cluster_labels(expected + np.eye(200))).all()
+
+
+def test_residue_contacts():
+    """Residues are paired by their closest heavy atoms"""
+    top = md.Topology()
+    chain = top.add_chain()
+    for _ in range(60):
+        residue = top.add_residue('MOL', chain)
+        for element in (md.element.carbon, md.element.carbon, md.element.hydrogen):
+            top.add_atom(element.symbol, element, residue)
+
+    rng = np.random.RandomState(11)
+    centers = rng.uniform(0, 3.0, size=(60, 1, 3))
+    xyz = (centers + rng.uniform(-0.2, 0.2, size=(60, 3, 3))).reshape(1, 180, 3)
+    trj = md.Trajectory(xyz, top, unitcell_lengths=[[3.0] * 3], unitcell_angles=[[90.0] * 3])
+
+    heavy = top.select('not element H')
+    atom_pairs = np.asarray([(i, j) for i in heavy for j in heavy
+                             if top.atom(i).residue.index < top.atom(j).residue.index])
+    close = md.compute_distances(trj, atom_pairs)[0] < 0.3
+    expected = {(top.atom(i).residue.index, top.atom(j).residue.index)
+                for i, j in atom_pairs[close]}
+
+    pairs = pairing.generate_residue_contacts(trj, cutoff=0.3)
+    assert set(map(tuple, pairs)) == expected
+    assert len(pairs) == len(expected)
+
+    direct_corr = pairing.generate_residue_contacts(trj, cutoff=0.3, output='sparse')
+    assert direct_corr.shape == (60, 60)
+    labels = pairing.generate_indirect_connectivity(direct_corr, output='labels')
+    assert (labels == pairing.cluster_labels(pairs, n_sites=60)).all()
+
+    # A selection without atoms pairs no residues
+    empty = pairing.generate_residue_contacts(trj, cutoff=0.3, atom_indices=top.select('name X'))
+    assert empty.shape == (0, 2)
+    assert empty.dtype.kind == 'i'
+    assert (pairing.generate_residue_contacts(trj, cutoff=0.3, atom_indices=[],
+                                              output='dense') == np.eye(60)).all()
@@ -0,0 +1,125 @@
+"""
+Unit and regression tests for trajectory-level analysis.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import numpy as np
+import mdtraj as md
+
+import pairing
+from pairing.tests.utils import make_com_trajectory
+
+
+@pytest.mark.parametrize('chunk', [1, 3, 100])
+def test_stream_direct_correlation(tmpdir, chunk):
+    trj = make_com_trajectory(80, n_frames=7)
+    top = str(tmpdir.join('top.pdb'))
+    filename = str(tmpdir.join('trj.dcd'))
+    trj[0].save_pdb(top)
+    trj.save_dcd(filename)
+
+    loaded = md.load(filename, top=top)
+    expected = pairing.generate_direct_correlation(loaded, cutoff=0.8, method='cell',
+                                                   per_frame=True, output='pairs')
+
+    results = list(pairing.stream_direct_correlation(filename, top, cutoff=0.8, chunk=chunk))
+    assert len(results) == 7
+    for (pairs, clusters), frame_pairs in zip(results, expected):
+        assert (pairs == frame_pairs).all()
+        assert (clusters.labels == pairing.cluster_labels(frame_pairs, n_sites=80)).all()
+
+
+def _make_dimer_trajectory(n_molecules, n_frames=2, box_length=3.0, seed=0):
+    """Diatomic C-O molecules, some split across the periodic boundary"""
+    top = md.Topology()
+    chain = top.add_chain()
+    for _ in range(n_molecules):
+        residue = top.add_residue('CO', chain)
+        top.add_atom('C', md.element.carbon, residue)
+        top.add_atom('O', md.element.oxygen, residue)
+
+    rng = np.random.RandomState(seed)
+    first = rng.uniform(0, box_length, size=(n_frames, n_molecules, 3))
+    second = first + rng.uniform(-0.1, 0.1, size=(n_frames, n_molecules, 3))
+    xyz = np.stack((first, second), axis=2).reshape(n_frames, -1, 3) % box_length
+    return md.Trajectory(xyz, top,
+                         unitcell_lengths=np.full((n_frames, 3), box_length),
+                         unitcell_angles=np.full((n_frames, 3), 90.0))
+
+
+def test_generate_com_trajectory():
+    trj = _make_dimer_trajectory(50)
+    com_trj = pairing.generate_com_trajectory(trj)
+    assert com_trj.n_atoms == com_trj.top.n_residues == 50
+    assert com_trj.n_frames == 2
+    assert com_trj.top.residue(0).name == 'CO'
+
+    # Reference: unwrap each oxygen next to its carbon, then mass-weight
+    masses = np.asarray([md.element.carbon.mass, md.element.oxygen.mass])
+    carbon, oxygen = trj.xyz[:, 0::2], trj.xyz[:, 1::2]
+    box = trj.unitcell_lengths[:, np.newaxis]
+    oxygen = carbon + (oxygen - carbon) - box * np.rint((oxygen - carbon) / box)
+    expected = (masses[0] * carbon + masses[1] * oxygen) / masses.sum()
+    assert np.allclose(com_trj.xyz, expected, atol=1e-5)
+
+    groups = [[0, 1, 2, 3], [4]]
+    assert pairing.generate_com_trajectory(trj, groups=groups).n_atoms == 2
+
+
+def test_stream_com(tmpdir):
+    trj = _make_dimer_trajectory(60, n_frames=4)
+    top = str(tmpdir.join('top.pdb'))
+    filename = str(tmpdir.join('trj.dcd'))
+    trj[0].save_pdb(top)
+    trj.save_dcd(filename)
+
+    com_trj = pairing.generate_com_trajectory(md.load(filename, top=top))
+    expected = pairing.generate_direct_correlation(com_trj, cutoff=0.8, per_frame=True,
+                                                   output='pairs', method='cell')
+    results = list(pairing.stream_direct_correlation(filename, top, cutoff=0.8, chunk=3,
+                                                     com=True))
+    assert len(results) == 4
+    for (pairs, _), frame_pairs in zip(results, expected):
+        assert (pairs == frame_pairs).all()
+
+
+@pytest.mark.parametrize('executor_class', [None, ThreadPoolExecutor])
+def test_parallel_direct_correlation(tmpdir, executor_class):
+    trj = make_com_trajectory(60, n_frames=11)
+    top = str(tmpdir.join('top.pdb'))
+    filename = str(tmpdir.join('trj.dcd'))
+    trj[0].save_pdb(top)
+    trj.save_dcd(filename)
+
+    expected = list(pairing.stream_direct_correlation(filename, top, cutoff=0.8))
+    executor = executor_class(2) if executor_class else None
+    results = list(pairing.parallel_direct_correlation(filename, top, cutoff=0.8, chunk=3,
+                                                       executor=executor, max_workers=2))
+    if executor is not None:
+        executor.shutdown()
+    assert len(results) == 11
+    for (pairs, clusters), (frame_pairs, frame_clusters) in zip(results, expected):
+        assert (pairs == frame_pairs).all()
+        assert (clusters.labels == frame_clusters.labels).all()
+
+
+def test_parallel_direct_correlation_stride(tmpdir):
+    """Tasks cover the frames selected by skip and stride without overlap"""
+    trj = make_com_trajectory(40, n_frames=12)
+    top = str(tmpdir.join('top.pdb'))
+    filename = str(tmpdir.join('trj.dcd'))
+    trj[0].save_pdb(top)
+    trj.save_dcd(filename)
+
+    expected = list(pairing.stream_direct_correlation(filename, top, cutoff=0.8, skip=1,
+                                                      stride=2))
+    with ThreadPoolExecutor(2) as executor:
+        results = list(pairing.parallel_direct_correlation(filename, top, cutoff=0.8, chunk=2,
+                                                           executor=executor, max_workers=2,
+                                                           skip=1, stride=2))
+    assert len(expected) == len(results) == 6
+    for (pairs, clusters), (frame_pairs, frame_clusters) in zip(results, expected):
+        assert (pairs == frame_pairs).all()
+        assert (clusters.labels == frame_clusters.labels).all()
@@ -0,0 +1,23 @@
+"""
+Shared helpers for the pairing tests.
+"""
+
+import numpy as np
+import mdtraj as md
+
+
+def make_com_trajectory(n_sites, n_frames=1, box_length=3.0, seed=0, names=('COM',)):
+    """Build a trajectory of single-atom residues at random positions,
+    cycling through the given residue names"""
+    top = md.Topology()
+    chain = top.add_chain()
+    for i in range(n_sites):
+        residue = top.add_residue(names[i % len(names)], chain)
+        top.add_atom('C', md.element.carbon, residue)
+
+    rng = np.random.RandomState(seed)
+    xyz = rng.uniform(0, box_length, size=(n_frames, n_sites, 3))
+    lengths = np.full((n_frames, 3), box_length)
+    angles = np.full((n_frames, 3), 90.0)
+    return md.Trajectory(xyz, top, unitcell_lengths=lengths,
+                         unitcell_angles=angles)
@@ -0,0 +1,323 @@
+"""
+trajectory.py
+prepare and stream trajectories for pairing analysis
+
+Handles atomistic trajectories and trajectories too large to load at once
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+import mdtraj as md
+
+from .clusters import ClusterLabels, cluster_frames
+from .pairing import _direct_pairs, _verlet_list
+
+
+class CenterOfMass(object):
+    """
+    Centers of mass of groups of atoms, reusable across trajectory chunks
+
+    Atom masses, the ordering of atoms by group and the topology of the
+    output trajectory are computed once, so each chunk costs a single
+    vectorized reduction.
+
+    Parameters
+    ----------
+    topology : mdtraj.Topology
+        Atomistic topology
+    groups : list of array-like, optional
+        Atom indices of each group. Defaults to one group per residue.
+    """
+
+    def __init__(self, topology, groups=None):
+        if groups is None:
+            groups = [[atom.index for atom in residue.atoms] for residue in topology.residues]
+        groups = [np.asarray(group, dtype=int) for group in groups]
+        if any(len(group) == 0 for group in groups):
+            raise ValueError('Every group must contain at least one atom')
+
+        self.atom_indices = np.concatenate(groups)
+        sizes = np.asarray([len(group) for group in groups])
+        self.starts = np.cumsum(sizes) - sizes
+        # Index within atom_indices of the first atom of the group of every atom
+        self.reference = np.repeat(self.starts, sizes)
+
+        masses = np.asarray([topology.atom(i).element.mass for i in self.atom_indices])
+        group_masses = np.add.reduceat(masses, self.starts)
+        if (group_masses <= 0).any():
+            raise ValueError('Every group must have a positive mass')
+        self.weights = masses / np.repeat(group_masses, sizes)
+
+        self.topology = md.Topology()
+        chain = self.topology.add_chain()
+        for group in groups:
+            name = topology.atom(group[0]).residue.name
+            residue = self.topology.add_residue(name, chain)
+            self.topology.add_atom(name, md.element.virtual, residue)
+
+    def compute(self, trj):
+        """
+        Compute the centers of mass of every frame of a trajectory
+
+        Each group is made whole before averaging by moving every atom to
+        its periodic image nearest the first atom of the group.
+
+        Parameters
+        ----------
+        trj : mdtraj.Trajectory
+            Atomistic trajectory with the topology of this object
+
+        Returns
+        -------
+        com_trj : mdtraj.Trajectory
+            Trajectory with one atom, in its own residue, per group
+        """
+
+        xyz = trj.xyz[:, self.atom_indices].astype(float)
+        reference = xyz[:, self.reference]
+        delta = xyz - reference
+        if trj.unitcell_vectors is not None:
+            box = trj.unitcell_vectors.astype(float)
+            fractional = np.matmul(delta, np.linalg.inv(box))
+            fractional -= np.rint(fractional)
+            delta = np.matmul(fractional, box)
+
+        weighted = delta * self.weights[np.newaxis, :, np.newaxis]
+        com = reference[:, self.starts] + np.add.reduceat(weighted, self.starts, axis=1)
+        return md.Trajectory(com, self.topology, time=trj.time,
+                             unitcell_lengths=trj.unitcell_lengths,
+                             unitcell_angles=trj.unitcell_angles)
+
+
+def generate_com_trajectory(trj, groups=None):
+    """
+    Build a COM-based trajectory from an atomistic mdtraj.Trajectory
+
+    Parameters
+    ----------
+    trj : mdtraj.Trajectory
+        Atomistic trajectory
+    groups : list of array-like, optional
+        Atom indices of each group. Defaults to one group per residue.
+
+    Returns
+    -------
+    com_trj : mdtraj.Trajectory
+        Trajectory with one atom per group, ready for
+        generate_direct_correlation
+    """
+
+    return CenterOfMass(trj.top, groups=groups).compute(trj)
+
+
+def stream_direct_correlation(filename, top, cutoff=1.0, method='cell', chunk=100,
+                              com=False, skin=None, **kwargs):
+    """
+    Pair and cluster a COM-based trajectory file frame by frame
+
+    Frames are read in chunks with mdtraj.iterload, so memory use is bounded
+    by the chunk size rather than the length of the trajectory.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the trajectory file
+    top : str, mdtraj.Trajectory or mdtraj.Topology
+        Topology of the trajectory, as accepted by mdtraj.iterload
+    cutoff : float or dict, default = 1.0
+        Distance cutoff below which two sites are considered paired, or
+        cutoffs keyed on pairs of residue names, see
+        generate_direct_correlation
+    method : str, default = 'cell'
+        Neighbor search used to find paired sites, see
+        generate_direct_correlation
+    chunk : int, default = 100
+        Number of frames read at a time
+    com : bool, default = False
+        Treat the trajectory as atomistic and pair the centers of mass of
+        its residues
+    skin : float, optional
+        Reuse a Verlet list with this skin across frames and chunks
+    **kwargs
+        Passed on to mdtraj.iterload, e.g. stride or atom_indices
+
+    Yields
+    ------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Paired sites (i < j) of one frame
+    clusters : ClusterLabels
+        Cluster labels of every site in the same frame
+    """
+
+    centers = None
+    neighbor_list = None if skin is None else _verlet_list(cutoff, skin, method)
+    for trj in md.iterload(filename, chunk=chunk, top=top, **kwargs):
+        if com:
+            if centers is None:
+                centers = CenterOfMass(trj.top)
+            trj = centers.compute(trj)
+        frame_pairs = _direct_pairs(trj, cutoff, method, neighbor_list=neighbor_list)
+        labels = cluster_frames(frame_pairs, trj.top.n_residues)
+        for pairs, frame_labels in zip(frame_pairs, labels):
+            yield pairs, ClusterLabels(frame_labels)
+
+
+def parallel_direct_correlation(filename, top, cutoff=1.0, method='cell', chunk=100,
+                                com=False, skin=None, executor=None, max_workers=None,
+                                n_frames=None, **kwargs):
+    """
+    Pair and cluster a trajectory file with frame ranges spread over processes
+
+    Every task reads its own range of frames from the file and returns only
+    the paired sites and cluster labels of each frame, so no trajectory or
+    dense matrix is ever sent between processes.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the trajectory file
+    top : str or mdtraj.Topology
+        Topology of the trajectory, as accepted by mdtraj.iterload
+    cutoff : float or dict, default = 1.0
+        Distance cutoff below which two sites are considered paired, or
+        cutoffs keyed on pairs of residue names, see
+        generate_direct_correlation
+    method : str, default = 'cell'
+        Neighbor search used to find paired sites, see
+        generate_direct_correlation
+    chunk : int, default = 100
+        Number of analyzed frames in each task
+    com : bool, default = False
+        Treat the trajectory as atomistic and pair the centers of mass of
+        its residues
+    skin : float, optional
+        Reuse a Verlet list with this skin across the frames of each task
+    executor : concurrent.futures.Executor, optional
+        Executor to run the tasks on. Defaults to a ProcessPoolExecutor of
+        spawned processes that is shut down once every frame has been
+        yielded.
+    max_workers : int, optional
+        Number of workers, defaults to the number of CPUs
+    n_frames : int, optional
+        Number of frames in the file, read from the file if not given
+    **kwargs
+        Passed on to mdtraj.iterload, e.g. atom_indices. skip and stride
+        select frames as they do for mdtraj.iterload, with chunk counting
+        the selected frames.
+
+    Yields
+    ------
+    pairs : np.ndarray, shape=(n_pairs, 2)
+        Paired sites (i < j) of one frame, in trajectory order
+    clusters : ClusterLabels
+        Cluster labels of every site in the same frame
+    """
+
+    if n_frames is None:
+        with md.open(filename) as handle:
+            n_frames = len(handle)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    skip = kwargs.pop('skip', 0)
+    stride = kwargs.pop('stride', 1)
+    if skip < 0 or stride < 1:
+        raise ValueError('skip must be non-negative and stride positive, got {} and {}'.format(
+            skip, stride))
+    # Frames of the file that are analyzed, in order
+    selected = range(skip, n_frames, stride)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = _process_pool(max_workers)
+
+    # Keep a couple of tasks per worker in flight so results are yielded in
+    # order without holding the whole trajectory's results in memory
+    tasks = (selected[start:start + chunk] for start in range(0, len(selected), chunk))
+    pending = deque()
+    try:
+        for frames in itertools.islice(tasks, 2 * max_workers):
+            pending.append(executor.submit(_analyze_frames, filename, top, frames.start,
+                                           frames.step, len(frames), cutoff, method, com,
+                                           skin, kwargs))
+        while pending:
+            results = pending.popleft().result()
+            for frames in itertools.islice(tasks, 1):
+                pending.append(executor.submit(_analyze_frames, filename, top, frames.start,
+                                               frames.step, len(frames), cutoff, method, com,
+                                               skin, kwargs))
+            for pairs, labels in results:
+                yield pairs, ClusterLabels(labels)
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
+
+
+def _process_pool(max_workers):
+    """
+    Process pool whose workers do not inherit the parent's threads
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of worker processes
+
+    Returns
+    -------
+    executor : concurrent.futures.ProcessPoolExecutor
+        Pool of spawned processes, or of the default kind before Python 3.7
+    """
+
+    if sys.version_info < (3, 7):
+        # The start method of the pool can only be chosen from Python 3.7
+        return ProcessPoolExecutor(max_workers=max_workers)
+    # Forking a process that has started compiled thread pools (e.g.
+    # Numba's) can deadlock, so workers are started fresh
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _analyze_frames(filename, top, start, stride, n_frames, cutoff, method, com, skin, kwargs):
+    """
+    Pair and cluster one evenly spaced range of frames of a trajectory file
+
+    Parameters
+    ----------
+    filename : str
+        Path of the trajectory file
+    top : str or mdtraj.Topology
+        Topology of the trajectory
+    start : int
+        First frame to analyze
+    stride : int
+        Spacing between analyzed frames
+    n_frames : int
+        Number of frames to analyze
+    cutoff : float or dict
+        Distance cutoff, or cutoffs keyed on pairs of residue names
+    method : str
+        Neighbor search used to find paired sites
+    com : bool
+        Pair the centers of mass of residues
+    skin : float or None
+        Skin of a Verlet list reused across the range
+    kwargs : dict
+        Passed on to mdtraj.iterload
+
+    Returns
+    -------
+    results : list of tuple
+        Paired sites and cluster label array of each frame
+    """
+
+    frames = stream_direct_correlation(filename, top, cutoff=cutoff, method=method,
+                                       chunk=n_frames, com=com, skin=skin, skip=start,
+                                       stride=stride, **kwargs)
+    return [(pairs, clusters.labels) for pairs, clusters in itertools.islice(frames, n_frames)]